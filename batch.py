@@ -0,0 +1,177 @@
+import argparse
+import copy
+import csv
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pygame as pg
+
+import settings as st
+from game_states import Game
+from simulate import load_layout, run_simulation
+
+# the settings that are read again for every game or every new sprite, the
+# workers reuse their Game and map, so settings that are only read when the
+# map is compiled or the Game is created (MAX_PATHS, FLOW_CELL_SIZE,
+# RENDER_SCALE, ...) would be silently ignored
+sweepable = ['mobs', 'shooters', 'waves', 'STARTING_MONEY', 'STARTING_LIVES',
+             'NAVIGATION', 'MAZE_MODE', 'FLOW_REPAIR_BUDGET']
+
+
+def set_setting(path, value):
+    # sets a value in settings by a dotted path like 'mobs.fast.hp' or
+    # 'waves.0.number' and returns the old value of the top level setting
+    keys = path.split('.')
+    if keys[0] not in sweepable:
+        raise KeyError('{} can\'t be swept, only {}'.format(
+                path, ', '.join(sweepable)))
+    old = copy.deepcopy(getattr(st, keys[0]))
+    if len(keys) == 1:
+        setattr(st, keys[0], value)
+        return old
+    target = getattr(st, keys[0])
+    for key in keys[1:-1]:
+        target = target[int(key) if isinstance(target, list) else key]
+    last = keys[-1]
+    if isinstance(target, list):
+        target[int(last)] = value
+    elif last in target:
+        target[last] = value
+    else:
+        raise KeyError(path)
+    return old
+
+
+def apply_overrides(overrides):
+    # applies {path: value} and returns a function that restores settings
+    saved = {}
+    for path, value in overrides.items():
+        name = path.split('.')[0]
+        old = set_setting(path, value)
+        saved.setdefault(name, old)
+
+    def restore():
+        for name, value in saved.items():
+            setattr(st, name, value)
+    return restore
+
+
+def load_sweep(path):
+    '''
+    a sweep is a json object with a grid of overrides, every combination of
+    their values is one variant:
+        {"overrides": {"mobs.fast.hp": [6, 8, 10], "STARTING_MONEY": [300, 400]},
+         "layouts": ["layouts/level2.json"], "seeds": [0, 1, 2]}
+    every variant is played with every layout and seed, a null layout
+    places no towers
+    '''
+    with open(path) as f:
+        sweep = json.load(f)
+    grid = sweep.get('overrides', {})
+    names = list(grid)
+    variants = [dict(zip(names, values))
+                for values in itertools.product(*(grid[name] for name in names))]
+    tasks = []
+    for n, overrides in enumerate(variants):
+        for layout in sweep.get('layouts', [None]):
+            for seed in sweep.get('seeds', [0]):
+                tasks.append({'variant': n, 'overrides': overrides,
+                              'layout': layout, 'seed': seed})
+    return names, tasks
+
+
+# ----------------- workers ---------------------------------------------------
+
+# every worker process plays all of its games with the same Game, so the
+# images and the map are only loaded once per process
+worker_game = None
+worker_layouts = {}
+
+
+def init_worker():
+    global worker_game
+    worker_game = Game(headless=True, seed=0)
+
+
+def run_task(task, dt=st.SIM_DT, max_time=3600):
+    layout = task['layout']
+    if layout not in worker_layouts:
+        worker_layouts[layout] = load_layout(layout) if layout else []
+    restore = apply_overrides(task['overrides'])
+    try:
+        # start() resets the world and reseeds it, the map and images stay
+        worker_game.seed = task['seed']
+        worker_game.start()
+        result = run_simulation(worker_game, worker_layouts[layout],
+                                dt, max_time)
+    finally:
+        restore()
+    row = {'variant': task['variant']}
+    row.update(task['overrides'])
+    row.update({'layout': layout or '', 'seed': task['seed']})
+    row.update(result)
+    return row
+
+
+def run_batch(tasks, workers=None, dt=st.SIM_DT, max_time=3600):
+    # plays the tasks on a pool of processes, the rows are returned in the
+    # order of the tasks
+    # compile the map once here, so the workers don't all compile it,
+    # compiling needs the display that the headless game sets up
+    Game(headless=True, seed=0)
+    pg.quit()
+    with ProcessPoolExecutor(workers, initializer=init_worker) as pool:
+        futures = [pool.submit(run_task, task, dt, max_time) for task in tasks]
+        rows = []
+        for n, future in enumerate(futures):
+            rows.append(future.result())
+            print('{}/{}'.format(n + 1, len(tasks)), end='\r', flush=True)
+    print()
+    return rows
+
+
+def save_rows(rows, path):
+    # csv or json, depending on the file extension
+    if path.endswith('.json'):
+        with open(path, 'w') as f:
+            json.dump(rows, f, indent=2)
+        return
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description='plays every combination of a sweep of setting '
+                        'overrides, layouts and seeds headless on all cores')
+    parser.add_argument('sweep', help='json file with the sweep, see load_sweep')
+    parser.add_argument('--out', default='results.csv',
+                        help='.csv or .json file for the results '
+                             '(default: results.csv)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of processes (default: all cores)')
+    parser.add_argument('--dt', type=float, default=st.SIM_DT,
+                        help='simulated seconds per step (default: SIM_DT)')
+    parser.add_argument('--max-time', type=float, default=3600,
+                        help='stop each game after this many simulated seconds')
+    args = parser.parse_args()
+
+    names, tasks = load_sweep(args.sweep)
+    # fail on unknown settings before starting any process
+    for task in tasks:
+        try:
+            apply_overrides(task['overrides'])()
+        except (KeyError, IndexError, AttributeError) as e:
+            parser.error('bad override: {}'.format(e))
+    start = time.perf_counter()
+    rows = run_batch(tasks, args.workers, args.dt, args.max_time)
+    save_rows(rows, args.out)
+    won = sum(row['won'] for row in rows)
+    print('{} games ({} won) in {:.1f}s on {} processes, results in {}'.format(
+            len(rows), won, time.perf_counter() - start,
+            args.workers or os.cpu_count(), args.out))
@@ -0,0 +1,224 @@
+import argparse
+import json
+import platform
+import subprocess
+import time
+
+import pygame as pg
+
+import maps as mp
+import settings as st
+import sprites as spr
+from game_states import Game
+from simulate import load_layout
+
+vec = pg.math.Vector2
+
+
+class Samples(dict):
+    '''
+    collects the durations of named phases, in seconds
+    '''
+    def time(self, name, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.add(name, time.perf_counter() - start)
+        return result
+
+
+    def add(self, name, seconds):
+        self.setdefault(name, []).append(seconds)
+
+
+    def summary(self):
+        # mean and percentiles in milliseconds for every phase
+        result = {}
+        for name, times in self.items():
+            times = sorted(times)
+            n = len(times)
+            percentile = lambda p: times[min(n - 1, int(n * p / 100))]
+            result[name] = {
+                    'n': n,
+                    'mean': 1000 * sum(times) / n,
+                    'p95': 1000 * percentile(95),
+                    'p99': 1000 * percentile(99),
+                    'max': 1000 * times[-1]
+                    }
+        return result
+
+
+# ----------------- scenario setup --------------------------------------------
+
+def spawn_mobs_on_paths(game, number, type_):
+    # spreads the mobs over random points of the map's paths
+    mobs = []
+    for _ in range(number):
+        path = game.rng.choice(game.paths)
+        k = game.rng.randrange(1, len(path))
+        a = path[k - 1].position
+        b = path[k].position
+        mob = spr.Mob(game, a.lerp(b, game.rng.random()), path, type_)
+        mob.current_target = k
+        mob.target = path[k]
+        mobs.append(mob)
+    return mobs
+
+
+def place_towers_near_paths(game, number, type_, distance=120):
+    # places the towers next to the paths, where they have something to do
+    ingame = game.states_dict['Ingame']
+    game.money = float('inf')
+    placed = 0
+    while placed < number:
+        path = game.rng.choice(game.paths)
+        k = game.rng.randrange(1, len(path))
+        pos = path[k - 1].position.lerp(path[k].position, game.rng.random())
+        pos += vec(distance, 0).rotate(game.rng.randrange(360))
+        if ingame.place_shooter(pos, type_):
+            placed += 1
+
+
+def setup_mobs_vs_machine_guns(game):
+    spawn_mobs_on_paths(game, 1000, 'standard')
+    place_towers_near_paths(game, 50, 'machine_gun')
+
+
+def setup_boss_rockets(game):
+    boss, = spawn_mobs_on_paths(game, 1, 'boss')
+    # the boss must survive the whole run
+    boss.max_hp = boss.hp = float('inf')
+
+    def refill():
+        # keep 200 rockets in the air
+        while game.projectiles.count < 200:
+            pos = boss.pos + vec(game.rng.randrange(300, 600), 0).rotate(
+                    game.rng.randrange(360))
+            game.projectiles.spawn('Rocket', pos, boss, 0)
+    return refill
+
+
+def setup_waves(game):
+    # the regular waves of level2 with the example layout
+    ingame = game.states_dict['Ingame']
+    for tower in load_layout('layouts/level2.json'):
+        game.money = st.shooters[tower['type']]['price']
+        ingame.place_shooter(tower['pos'], tower['type'])
+    game.money = st.STARTING_MONEY
+
+
+# ----------------- measurements ----------------------------------------------
+
+# the phases of Ingame.step, see profiler.py
+step_phases = ['mob update', 'shooter update', 'projectile update', 'waves']
+
+
+def run_frames(setup, frames, warmup=10):
+    '''
+    runs Ingame.step and draw_sprites once per frame, the step is timed
+    through the phases of the game's profiler, setup can return a function
+    that is called between frames (untimed) to keep the scenario going
+    '''
+    game = Game(headless=True, seed=0)
+    game.show_lifebars = True
+    ingame = game.states_dict['Ingame']
+    profiler = game.profiler
+    between_frames = setup(game)
+    samples = Samples()
+    for frame in range(warmup + frames):
+        if frame == warmup:
+            samples.clear()
+        if between_frames:
+            between_frames()
+        profiler.next_frame()
+        samples.time('step', ingame.step, st.SIM_DT)
+        for phase in step_phases:
+            samples.add(phase, profiler.times[phase])
+        samples.time('draw_sprites', game.draw_sprites, game.screen)
+    return samples, {
+            'mobs': len(game.mobs),
+            'shooters': len(game.shooters),
+            'projectiles': game.projectiles.count
+            }
+
+
+def run_map_load(file, repeats):
+    # compiles the map from the tmx without the cache, the headless game
+    # only sets up the display that loading the tilesets needs
+    Game(headless=True, seed=0)
+    # make sure the compiled map is in the cache
+    mp.get_map(file)
+    samples = Samples()
+    for _ in range(repeats):
+        game_map = mp.Map(file)
+        samples.time('load_tmx', game_map.load_tmx)
+        samples.time('visibility_graph', mp.build_visibility_graph,
+                     game_map.nodes, game_map.walls)
+        samples.time('find_paths', mp.find_paths, game_map.start_node,
+                     game_map.end_node,
+                     game_map.properties.get('max_paths', st.MAX_PATHS))
+        # the whole way through get_map: hashing the tmx files, reading and
+        # unpickling the cache file and unpacking it
+        mp.loaded_maps.pop(file, None)
+        samples.time('load_cached', mp.get_map, file)
+    return samples, {
+            'nodes': len(game_map.nodes),
+            'paths': len(game_map.paths)
+            }
+
+
+scenarios = {
+        'mobs_vs_machine_guns': lambda args: run_frames(
+                setup_mobs_vs_machine_guns, args.frames),
+        'boss_rockets': lambda args: run_frames(
+                setup_boss_rockets, args.frames),
+        'waves_level2': lambda args: run_frames(
+                setup_waves, args.frames * 10),
+        'map_level1': lambda args: run_map_load('level1', args.repeats),
+        'map_level2': lambda args: run_map_load('level2', args.repeats)
+        }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description='times the game in named scenarios')
+    parser.add_argument('scenarios', nargs='*', metavar='scenario',
+                        help='any of {} (default: all)'.format(
+                                ', '.join(scenarios)))
+    parser.add_argument('--frames', type=int, default=300,
+                        help='measured frames per scenario (default: 300)')
+    parser.add_argument('--repeats', type=int, default=5,
+                        help='how often maps are loaded (default: 5)')
+    parser.add_argument('--json', metavar='FILE',
+                        help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.scenarios or scenarios:
+        samples, counts = scenarios[name](args)
+        results[name] = {'phases': samples.summary(), 'counts': counts}
+        print('\n{}  {}'.format(name, '  '.join(
+                '{}: {}'.format(k, v) for k, v in counts.items())))
+        print('  {:<20}{:>9}{:>9}{:>9}{:>9}'.format(
+                'phase (ms)', 'mean', 'p95', 'p99', 'max'))
+        for phase, stats in results[name]['phases'].items():
+            print('  {:<20}{mean:>9.3f}{p95:>9.3f}{p99:>9.3f}{max:>9.3f}'.format(
+                    phase, **stats))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                    'commit': git_commit(),
+                    'python': platform.python_version(),
+                    'pygame': pg.version.ver,
+                    'frames': args.frames,
+                    'repeats': args.repeats,
+                    'scenarios': results
+                    }, f, indent=2)
@@ -1,10 +1,15 @@
 import pygame as pg
+import numpy as np
+import os
+import random
 from pytmx.util_pygame import load_pygame
 #import traceback
 
 import sprites as spr
 import settings as st
 import maps as mp
+import profiler as prof
+import replay as rp
 
 vec = pg.math.Vector2
 
@@ -16,7 +21,8 @@ class Camera(object):
         self.speed = st.CAMERA_SPEED
         self.offset = vec()
         self.move = vec()
-        self.zoom_level = 1
+        self.zoom_index = st.ZOOM_LEVELS.index(1)
+        self.set_zoom(1)
         
     
     def update(self, dt):
@@ -31,7 +37,7 @@ class Camera(object):
                     self.move *= st.CAMERA_SPEED / 10000.0
         else:
             # move camera with the WASD keys
-            keys = pg.key.get_pressed()
+            keys = self.game.keys
             self.move.x = keys[pg.K_a] - keys[pg.K_d]
             self.move.y = keys[pg.K_w] - keys[pg.K_s]
             spr.limit(self.move, 1)
@@ -43,28 +49,172 @@ class Camera(object):
         self.offset.x = min(self.offset.x, 0)
         self.offset.y = min(self.offset.y, 0)
         # camera can't go over bottom right borders
-        self.offset.x = max(self.offset.x, (self.game.map_rect.w - 
-                                            self.game.screen_rect.w) * -1)
-        self.offset.y = max(self.offset.y, (self.game.map_rect.h - 
-                                            self.game.screen_rect.h) * -1)
+        view_w, view_h = self.view_size()
+        self.offset.x = max(self.offset.x, (self.game.map_rect.w - view_w) * -1)
+        self.offset.y = max(self.offset.y, (self.game.map_rect.h - view_h) * -1)
         
     
+    def view_size(self):
+        # size of the visible part of the map
+        return vec(st.SCREEN_W, st.SCREEN_H) / self.zoom_level
+    
+    
     def apply_mouse(self, m_pos):
-        return m_pos - self.offset
+        # screen to map coordinates
+        return m_pos / self.zoom_level - self.offset
     
 
     def apply_pos(self, pos):
-        return pos + self.offset
+        # map to render coordinates
+        return (self.offset + pos) * self.scale
 
 
     def apply_rect(self, rect):
-        return pg.Rect(rect.topleft + self.offset, rect.size)
+        return pg.Rect(self.apply_pos(rect.topleft),
+                       (rect.w * self.scale, rect.h * self.scale))
+    
+    
+    def set_zoom(self, zoom_level):
+        self.zoom_level = zoom_level
+        # pixels of the render target per map pixel
+        self.scale = zoom_level * self.game.screen.get_width() / st.SCREEN_W
+    
     
     def zoom(self):
+        # step through the zoom levels, the center of the view stays put
+        index = self.zoom_index
         if self.game.mouse_pressed[3]:
-            self.zoom_level += 0.1
+            index += 1
         elif self.game.mouse_pressed[4]:
-            self.zoom_level -= 0.1
+            index -= 1
+        index = spr.constrain(index, 0, len(st.ZOOM_LEVELS) - 1)
+        if index != self.zoom_index:
+            center = self.view_size() / 2 - self.offset
+            self.zoom_index = index
+            self.set_zoom(st.ZOOM_LEVELS[index])
+            self.offset = self.view_size() / 2 - center
+            self.offset.update(int(self.offset.x), int(self.offset.y))
+    
+
+
+class Hud(object):
+    '''
+    the texts at the top of the screen, the labels are drawn once onto a
+    static layer and each value is only rendered again when it changes
+    '''
+    # field name: label, position
+    fields = {
+            'money': ('Money: ', (10, 10)),
+            'elapsed': ('Elapsed time: ', (160, 10)),
+            'next_wave': ('Time until next wave: ', (360, 10)),
+            'lives': ('Lives: ', (680, 10))
+            }
+    
+    def __init__(self, game):
+        self.game = game
+        self.font = game.font
+        self.layer = pg.Surface((game.screen_rect.w, self.font.get_linesize() + 10),
+                                pg.SRCALPHA)
+        self.value_pos = {}
+        for name, (label, pos) in self.fields.items():
+            pos = (int(pos[0] * game.ui_scale), int(pos[1] * game.ui_scale))
+            self.layer.blit(self.font.render(label, False, st.WHITE), pos)
+            self.value_pos[name] = (pos[0] + self.font.size(label)[0], pos[1])
+        # field name: (value, rendered value)
+        self.values = {}
+        # tower type: range preview
+        self.range_previews = {}
+    
+    
+    def set(self, name, value):
+        if name not in self.values or self.values[name][0] != value:
+            surf = self.font.render(str(value), False, st.WHITE)
+            prof.count_allocation()
+            self.values[name] = (value, surf)
+    
+    
+    def draw(self, screen):
+        screen.blit(self.layer, (0, 0))
+        for name, (value, surf) in self.values.items():
+            screen.blit(surf, self.value_pos[name])
+    
+    
+    def range_preview(self, type_):
+        # dark circle that shows the range of a tower type
+        preview = self.range_previews.get(type_)
+        if preview is None:
+            r = st.shooters[type_]['perception_radius']
+            preview = pg.Surface((r * 2, r * 2), pg.SRCALPHA)
+            preview.fill(st.TRANS)
+            pg.draw.ellipse(preview, (20, 20, 20), preview.get_rect())
+            prof.count_allocation()
+            self.range_previews[type_] = preview
+        return preview
+    
+
+
+class Minimap(object):
+    '''
+    the map and the towers are drawn onto a static layer that is only
+    redrawn after a tower was placed or sold, the mobs are written into
+    the pixels of a copy of it in one go every frame
+    '''
+    mob_color = (180, 0, 0)
+    shooter_color = (100, 200, 100)
+    
+    def __init__(self, game, size=(256, 200)):
+        self.game = game
+        self.size = size
+        self.background = None
+        self.static = pg.Surface(size)
+        self.image = pg.Surface(size)
+        self.image.set_alpha(200)
+        self.dirty = True
+        self.scale_x = size[0] / game.map_rect.w
+        self.scale_y = size[1] / game.map_rect.h
+    
+    
+    def rebuild(self):
+        if self.background is None:
+            self.background = pg.transform.smoothscale(self.game.bg_image,
+                                                       self.size)
+            prof.count_allocation()
+        self.static.blit(self.background, (0, 0))
+        for shooter in self.game.shooters:
+            pos_x = int(shooter.base_rect.x * self.scale_x)
+            pos_y = int(shooter.base_rect.y * self.scale_y)
+            pg.draw.rect(self.static, self.shooter_color, ((pos_x, pos_y), (6, 6)))
+        self.dirty = False
+    
+    
+    def draw(self, screen):
+        if self.dirty:
+            self.rebuild()
+        self.image.blit(self.static, (0, 0))
+        map_w, map_h = self.size
+        if self.game.mobs:
+            # 4x4 dots at the top left corner of each mob
+            pos = np.array([mob.rect.topleft for mob in self.game.mobs])
+            xs = np.floor(pos[:, 0] * self.scale_x).astype(int)[:, None] + np.arange(4)
+            ys = np.floor(pos[:, 1] * self.scale_y).astype(int)[:, None] + np.arange(4)
+            xs, ys = np.broadcast_arrays(xs[:, :, None], ys[:, None, :])
+            # leave out the pixels of mobs outside of the map, like the
+            # spawning ones, instead of piling them up at the border
+            inside = (xs >= 0) & (xs < map_w) & (ys >= 0) & (ys < map_h)
+            pixels = pg.surfarray.pixels3d(self.image)
+            pixels[xs[inside], ys[inside]] = self.mob_color
+            del pixels
+        
+        # draw camera rect
+        cam_p = self.game.camera.offset * -1
+        pos_x = int(cam_p.x * self.scale_x)
+        pos_y = int(cam_p.y * self.scale_y)
+        view_w, view_h = self.game.camera.view_size()
+        w = int(view_w * self.scale_x)
+        h = int(view_h * self.scale_y)
+        pg.draw.rect(self.image, (255, 255, 255), ((pos_x, pos_y), (w, h)), 2)
+        
+        screen.blit(self.image, (screen.get_width() - map_w - 10, 10))
     
 
 
@@ -86,7 +236,16 @@ class State(object):
     def update(self, dt):
         pass
     
+    def step(self, dt):
+        # advances the game world by one fixed simulation step
+        pass
+    
+    def draw_world(self, screen):
+        # draws the map and sprites in the render resolution, see Game.draw
+        pass
+    
     def draw(self, screen):
+        # draws the menus and the hud onto the display
         pass
     
 
@@ -110,43 +269,110 @@ class Ingame(State):
                 game.wave_spawner.done = False
     
     
+    def step(self, dt):
+        # advance the game world by dt, this doesn't look at any input
+        profiler = self.game.profiler
+        self.game.elapsed_seconds += dt
+        profiler.start('mob update')
+        # index the mobs once per frame for the range queries of
+        # Shooter.find_target (separation uses spr.neighbour_pairs instead)
+        self.game.mob_grid.rebuild(self.game.mobs)
+        if self.game.maze:
+            # spread the repair after placing or selling over a few steps
+            self.game.flow_field.repair(st.FLOW_REPAIR_BUDGET)
+        spr.steer_mobs(self.game, dt)
+        self.game.mobs.update(dt)
+        profiler.start('shooter update')
+        self.game.shooters.update(dt)
+        profiler.start('projectile update')
+        self.game.projectiles.update(dt)
+        self.game.effects.update(dt)
+
+        profiler.start('waves')
+        self.spawn_waves(self.game, dt)
+        profiler.stop()
+
+        if self.game.lives <= 0:
+            self.done = True
+        self.game.ticks += 1
+
+
+    def place_shooter(self, pos, type_):
+        # returns the new shooter, or None if it can't be placed there
+        # prevent placement on a road
+        road_hits = [x.rect.collidepoint(pos) for x in self.game.roads]
+        if ((1 in road_hits and not self.game.maze) or
+                self.game.money < st.shooters[type_]['price']):
+            return None
+        s = spr.Shooter(self.game, pos, type_)
+        # prevent placement on other towers
+        hits = pg.sprite.spritecollide(s, self.game.shooters, False)
+        for hit in hits:
+            if hit != s:
+                s.kill()
+                return None
+        if self.game.maze and not self.block_cells(s):
+            s.kill()
+            return None
+        self.game.money -= s.price
+        self.game.minimap.dirty = True
+        return s
+
+
+    def block_cells(self, shooter):
+        # maze mode: removes the cells under the shooter from the flow
+        # field, unless that would cut off the start or a mob from the exit
+        field = self.game.flow_field
+        cells = field.cells_in_rect(shooter.rect)
+        shooter.blocked_cells = cells
+        if not cells:
+            return True
+        sources = {field.cell(self.game.start_node.position)}
+        for mob in self.game.mobs:
+            cell = field.cell(mob.pos)
+            # mobs under the new tower walk off it on their own
+            if field.walkable[cell] and cell not in cells:
+                sources.add(cell)
+        if not field.connected(cells, sources):
+            return False
+        field.set_walkable(cells, False)
+        return True
+
+
+    def sell_shooter(self, pos):
+        for s in self.game.shooters:
+            if s.rect.collidepoint(pos):
+                self.game.money += s.refund
+                s.kill()
+                if self.game.maze and s.blocked_cells:
+                    self.game.flow_field.set_walkable(s.blocked_cells, True)
+                self.game.minimap.dirty = True
+
+
     def update(self, dt):
-        self.game.elapsed_seconds += dt       
-        self.game.all_sprites.update(dt)
-        
+        # runs once per rendered frame, the world is advanced by step()
         # place the selected turret
+        # every action is recorded, see replay.py
         m_pos = self.game.camera.apply_mouse(self.game.mouse_pos)
+        recorder = self.game.recorder
         if self.game.mouse_pressed[0]:
-            # prevent placement on a road
-            road_hits = [x.rect.collidepoint(m_pos) for x in self.game.roads]
-            if not 1 in road_hits:
-                if self.game.money >= st.shooters[self.game.selected_shooter]['price']:
-                    s = spr.Shooter(self.game, m_pos, self.game.selected_shooter)
-                    # prevent placement on other towers
-                    hits = pg.sprite.spritecollide(s, self.game.shooters, False)
-                    for hit in hits:
-                        if hit != s:
-                            s.kill()
-                            break
-                    else:
-                        self.game.money -= s.price          
+            recorder.record('place', self.game.selected_shooter, m_pos.x, m_pos.y)
+            self.place_shooter(m_pos, self.game.selected_shooter)
         if self.game.mouse_pressed[2]:
-            for s in self.game.shooters:
-                if s.rect.collidepoint(m_pos):
-                    self.game.money += s.refund
-                    s.kill()
-              
+            recorder.record('sell', m_pos.x, m_pos.y)
+            self.sell_shooter(m_pos)
+
         # camera control
         self.game.camera.update(dt)
 
-        self.spawn_waves(self.game, dt)
-    
         # select a different tower
         if self.game.key_pressed == pg.K_t:
             self.game.selected_shooter = next(st.shooter_it)
+            recorder.record('select', self.game.selected_shooter)
         
-        if self.game.lives <= 0:
-            self.done = True
+        # change the game speed
+        if self.game.key_pressed in st.GAME_SPEEDS:
+            self.game.speed = st.GAME_SPEEDS[self.game.key_pressed]
             
         # Pause menu
         if self.game.key_pressed == pg.K_ESCAPE:
@@ -159,58 +385,38 @@ class Ingame(State):
             
         if self.game.debug_mode:
             c = 'FPS: {}   DEBUG MODE ACTIVATED'.format(round(self.game.clock.get_fps(), 2))
+            # occupancy of the object pools and how often they had to grow
+            flashes = self.game.flash_pool
+            projectiles = self.game.projectiles
+            c += '   flashes: {}/{} created'.format(
+                    flashes.in_use(), flashes.created)
+            c += '   projectiles: {}/{} ({} misses)'.format(
+                    projectiles.count, projectiles.capacity, projectiles.misses)
         else:          
             c = 'FPS: {}'.format(round(self.game.clock.get_fps(), 2))
+        c += '   speed: {}x'.format(self.game.speed)
         pg.display.set_caption(c)
         
             
 
 
-    def draw(self, screen):
-        #self.game.camera.apply_rect(self.game.map_rect)
-        screen.blit(self.game.bg_image, self.game.map_rect.topleft + self.game.camera.offset)
-        self.game.draw_sprites(screen)
-        # draw text on screen
-        text = 'Money: {}'.format(self.game.money)
-        txt_surf = self.game.font.render(text, False, st.WHITE)
-        screen.blit(txt_surf, (10, 10))        
-        
-        seconds = int(self.game.elapsed_seconds % 60)
-        minutes = int(self.game.elapsed_seconds / 60)
-        text = 'Elapsed time: {x:02d}:{y:02d}'.format(x=minutes, y=seconds)
-        txt_surf = self.game.font.render(text, False, st.WHITE)
-        screen.blit(txt_surf, (160, 10))
-        
-        s_to_wave = (st.waves[self.game.current_wave]['starting_time'] 
-                     - self.game.elapsed_seconds)
-        s_to_wave = max(0, s_to_wave)
-        seconds = int(s_to_wave % 60)
-        minutes = int(s_to_wave / 60)
-        text = 'Time until next wave: {x:02d}:{y:02d}'.format(
-                x=minutes, y=seconds)
-        txt_surf = self.game.font.render(text, False, st.WHITE)
-        screen.blit(txt_surf, (360, 10))
-        
-        text = 'Lives: {}'.format(self.game.lives)
-        txt_surf = self.game.font.render(text, False, st.WHITE)
-        screen.blit(txt_surf, (680, 10))
-               
+    def draw_world(self, screen):
+        camera = self.game.camera
+        queue = self.game.render_queue
+        queue.add('ground', self.game.bg_image, camera.apply_pos(self.game.map_rect.topleft))
         # draw a sample shooter
-        r = st.shooters[self.game.selected_shooter]['perception_radius']
-        radius_surf = pg.Surface((r * 2,r * 2), pg.SRCALPHA)
-        radius_surf.fill(st.TRANS)
-        pg.draw.ellipse(radius_surf, (20, 20, 20), radius_surf.get_rect())     
-        sample_shooter = self.game.images[st.shooters[self.game.selected_shooter]['image']]
+        type_ = self.game.selected_shooter
+        m_pos = camera.apply_mouse(self.game.mouse_pos)
+        r = st.shooters[type_]['perception_radius']
+        queue.add('preview', self.game.hud.range_preview(type_),
+                  camera.apply_pos(m_pos - vec(r, r)), pg.BLEND_RGBA_SUB)
+        sample_shooter = self.game.images[st.shooters[type_]['image']]
         size = sample_shooter.get_rect().size
-        p = (self.game.mouse_pos.x - r, self.game.mouse_pos.y - r)
-        screen.blit(radius_surf, p, special_flags=pg.BLEND_RGBA_SUB)       
-        screen.blit(sample_shooter, self.game.mouse_pos - vec(size) / 2)
+        queue.add('preview', sample_shooter, camera.apply_pos(m_pos - vec(size) / 2))
+        self.game.draw_sprites(screen)
         
-        self.draw_minimap(screen)
-                    
         # DEBUG STUFF!!!!
         if self.game.debug_mode:
-            camera = self.game.camera
             for s in self.game.shooters:
                 if s.target:
                     start = camera.apply_pos(s.pos)
@@ -222,9 +428,19 @@ class Ingame(State):
                 end = camera.apply_pos(m.pos + m.vel * 20)
                 pg.draw.line(screen, st.WHITE, start, end, 2)
             
-                if len(m.path) > 1:
+                if m.path and len(m.path) > 1:
                     path_ = list(map(lambda x: camera.apply_pos(x.position), m.path))
                     pg.draw.lines(screen, st.WHITE, False, path_)
+            
+            if self.game.navigation == 'flow_field':
+                # direction of every walkable cell
+                field = self.game.flow_field
+                size = field.cell_size
+                for row, col in np.argwhere(field.walkable).tolist():
+                    center = vec(col + 0.5, row + 0.5) * size
+                    end = center + vec(field.direction[row, col].tolist()) * size / 2
+                    pg.draw.line(screen, st.WHITE, camera.apply_pos(center),
+                                 camera.apply_pos(end))
                      
             # draw rects
             for sprite in self.game.all_sprites:
@@ -234,40 +450,28 @@ class Ingame(State):
             for road in self.game.roads:
                 pg.draw.rect(screen, st.WHITE, camera.apply_rect(road.rect), 1)
                 
-            for bullet in self.game.bullets:
-                if hasattr(bullet, 'target'):
-                    if bullet.target:
-                        start = camera.apply_pos(bullet.pos)
-                        end = camera.apply_pos(bullet.target.pos)
-                        pg.draw.line(screen, st.WHITE, start, end)
-                
+            self.game.projectiles.draw_debug(screen)
     
-    def draw_minimap(self, screen):
-        map_w, map_h = 256, 200
-        map_surf = pg.Surface((map_w, map_h), pg.SRCALPHA)
-        map_surf.fill((0, 0, 0, 100))
-        gm_w, gm_h = self.game.map_rect.size
-        for mob in self.game.mobs:
-            pos_x = int(mob.rect.x / gm_w * map_w)
-            pos_y = int(mob.rect.y / gm_h * map_h)
-            pg.draw.rect(map_surf, (180, 0, 0), ((pos_x, pos_y), (4, 4)))
-        
-        for shooter in self.game.shooters:
-            pos_x = int(shooter.base_rect.x / gm_w * map_w)
-            pos_y = int(shooter.base_rect.y / gm_h * map_h)
-            pg.draw.rect(map_surf, (100, 200, 100), ((pos_x, pos_y), (6, 6)))
-        
-        # draw camera rect
-        cam_p = self.game.camera.offset * -1
-        pos_x = int(cam_p.x / gm_w * map_w)
-        pos_y = int(cam_p.y / gm_h * map_h)
-        w = int(st.SCREEN_W / gm_w * map_w)
-        h = int(st.SCREEN_H / gm_h * map_h)
-        pg.draw.rect(map_surf, (255, 255, 255), ((pos_x, pos_y), (w, h)), 2)
+    
+    def draw(self, screen):
+        # draw text on screen, the hud only renders values that changed
+        hud = self.game.hud
+        hud.set('money', self.game.money)
+        seconds = int(self.game.elapsed_seconds % 60)
+        minutes = int(self.game.elapsed_seconds / 60)
+        hud.set('elapsed', '{x:02d}:{y:02d}'.format(x=minutes, y=seconds))
         
-        screen.blit(map_surf, (st.SCREEN_W - map_w - 10, 10))
+        s_to_wave = (st.waves[self.game.current_wave]['starting_time'] 
+                     - self.game.elapsed_seconds)
+        s_to_wave = max(0, s_to_wave)
+        seconds = int(s_to_wave % 60)
+        minutes = int(s_to_wave / 60)
+        hud.set('next_wave', '{x:02d}:{y:02d}'.format(x=minutes, y=seconds))
+        hud.set('lives', self.game.lives)
+        hud.draw(screen)
         
-    
+        self.game.minimap.draw(screen)
+                
     
 class Game_lost(State):
     def __init__(self, game):
@@ -284,10 +488,13 @@ class Game_lost(State):
             self.done = True
     
     
+    def draw_world(self, screen):
+        self.game.render_queue.add('ground', self.game.bg_image,
+                                   self.game.camera.apply_pos(self.game.map_rect.topleft))
+        self.game.draw_sprites(screen)
+    
+    
     def draw(self, screen):
-        screen.blit(self.game.bg_image, (0, 0))
-        self.game.all_sprites.draw(screen)
-        
         # draw text on screen
         text = 'You lost the game :(   Press R to restart'
         txt_surf = self.game.font.render(text, False, st.WHITE)
@@ -308,7 +515,8 @@ class Pause_menu(State):
     def __init__(self, game):
         super().__init__(game)
         self.next = 'Ingame'
-        self.overlay = pg.Surface((st.TILESIZE * 8, st.TILESIZE * 10), 
+        self.overlay = pg.Surface((int(st.TILESIZE * 8 * game.ui_scale),
+                                   int(st.TILESIZE * 10 * game.ui_scale)),
                                   pg.SRCALPHA)
         self.overlay.fill((0, 0, 0, 100))
         self.overlay_rect = self.overlay.get_rect()
@@ -318,8 +526,8 @@ class Pause_menu(State):
                         'Options',
                         'Go to Title']
         self.options_pos = 0        
-        self.font = pg.font.SysFont('Arial', 40)
-        self.font_bold = pg.font.SysFont('Arial', 52, bold=True)
+        self.font = game.ui_font(40)
+        self.font_bold = game.ui_font(52, bold=True)
     
     
     def startup(self):
@@ -347,10 +555,13 @@ class Pause_menu(State):
             self.done = True
     
     
-    def draw(self, screen):
-        screen.blit(self.game.bg_image, 
-                    self.game.map_rect.topleft + self.game.camera.offset)
+    def draw_world(self, screen):
+        self.game.render_queue.add('ground', self.game.bg_image,
+                                   self.game.camera.apply_pos(self.game.map_rect.topleft))
         self.game.draw_sprites(screen)
+    
+    
+    def draw(self, screen):
         screen.blit(self.overlay, self.overlay_rect)
         
         # PUT THIS IN A FUNCTION/OBJECT; THIS IS ALREADY COPYPASTE
@@ -360,11 +571,11 @@ class Pause_menu(State):
             else:
                 text_surface = self.font.render(self.options[i], False, st.WHITE)
             text_rect = text_surface.get_rect()
-            height = st.SCREEN_H // 18 * (i + 7)
-            text_rect.center = ((st.SCREEN_W // 2, height))
+            height = self.game.screen_rect.h // 18 * (i + 7)
+            text_rect.center = ((self.game.screen_rect.w // 2, height))
             screen.blit(text_surface, text_rect)
             
-            if text_rect.collidepoint(self.game.mouse_pos):
+            if text_rect.collidepoint(self.game.ui_mouse_pos):
                 self.options_pos = i
                 if self.game.mouse_pressed[0]:
                     self.execute_option()
@@ -386,9 +597,10 @@ class Start_screen(State):
                    'Options',
                    'Exit']     
         self.options_pos = 0
+        self.title = None
         
-        self.font = pg.font.SysFont('Arial', 40)
-        self.font_bold = pg.font.SysFont('Arial', 52, bold=True)
+        self.font = game.ui_font(40)
+        self.font_bold = game.ui_font(52, bold=True)
     
     
     def startup(self):
@@ -418,7 +630,11 @@ class Start_screen(State):
         
     
     def draw(self, screen):
-        screen.blit(self.game.images['title_screen'], (0, 0)) 
+        if self.title is None:
+            # the title image has the screen size, scale it once
+            self.title = pg.transform.smoothscale(self.game.images['title_screen'],
+                                                  self.game.screen_rect.size)
+        screen.blit(self.title, (0, 0)) 
             
         for i in range(len(self.options)):
             if self.options_pos == i:
@@ -426,11 +642,11 @@ class Start_screen(State):
             else:
                 text_surface = self.font.render(self.options[i], False, st.BLACK)
             text_rect = text_surface.get_rect()
-            height = st.SCREEN_H // 18 * (i + 7)
-            text_rect.center = ((st.SCREEN_W // 2, height))
+            height = self.game.screen_rect.h // 18 * (i + 7)
+            text_rect.center = ((self.game.screen_rect.w // 2, height))
             screen.blit(text_surface, text_rect)
             
-            if text_rect.collidepoint(self.game.mouse_pos):
+            if text_rect.collidepoint(self.game.ui_mouse_pos):
                 self.options_pos = i
                 if self.game.mouse_pressed[0]:
                     self.execute_option()
@@ -451,8 +667,8 @@ class Options(State):
                         ]     
         self.options_pos = 0
         
-        self.font = pg.font.SysFont('Arial', 40)
-        self.font_bold = pg.font.SysFont('Arial', 52, bold=True)
+        self.font = game.ui_font(40)
+        self.font_bold = game.ui_font(52, bold=True)
     
     
     def update(self, dt):
@@ -493,11 +709,11 @@ class Options(State):
             else:
                 text_surface = self.font.render(self.options[i], False, st.WHITE)
             text_rect = text_surface.get_rect()
-            height = st.SCREEN_H // 18 * (i + 7)
-            text_rect.center = ((st.SCREEN_H // 2, height))
+            height = self.game.screen_rect.h // 18 * (i + 7)
+            text_rect.center = ((self.game.screen_rect.h // 2, height))
             screen.blit(text_surface, text_rect)
             
-            if text_rect.collidepoint(self.game.mouse_pos):
+            if text_rect.collidepoint(self.game.ui_mouse_pos):
                 self.options_pos = i
                 if self.game.mouse_pressed[0]:
                     self.execute_option()
@@ -505,31 +721,64 @@ class Options(State):
 
 
 class Game:
-    def __init__(self):
+    def __init__(self, headless=False, seed=None):
+        # headless games have no window and only run the Ingame state,
+        # see simulate.py
+        self.headless = headless
+        # all randomness of the game comes from self.rng, which is seeded
+        # with this on every start, so a game can be replayed
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.seed = seed
+        if headless:
+            # SDL still needs a video driver to convert the images
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
         pg.init()
         self.clock = pg.time.Clock()
         pg.mouse.set_visible(True)
-        self.display = pg.display.set_mode((st.DISPLAY_W, st.DISPLAY_H))
-        self.screen = pg.Surface((st.SCREEN_W, st.SCREEN_H))
-        self.screen_rect = self.screen.get_rect()                      
+        if headless:
+            self.display = pg.display.set_mode((1, 1))
+        else:
+            self.display = pg.display.set_mode((st.DISPLAY_W, st.DISPLAY_H))
+        self.create_render_target()
+        # the menus and the hud are drawn straight onto the display, their
+        # layout and fonts were made for SCREEN_W and are scaled by this
+        self.screen_rect = pg.Rect(0, 0, st.DISPLAY_W, st.DISPLAY_H)
+        self.ui_scale = st.DISPLAY_W / st.SCREEN_W
         self.event_list = []
-        self.font = pg.font.SysFont('Arial', 24)
+        self.font = self.ui_font(24)
         # MEMO: make a 'fonts' dict with different fonts
+        self.profiler = prof.Profiler(self)
+        self.hud = Hud(self)
+        self.render_queue = spr.Render_queue()
         
-        self.states_dict = {
-                'Start_screen': Start_screen(self),
-                'Options': Options(self),
-                'Ingame': Ingame(self),
-                'Pause_menu': Pause_menu(self),
-                'Game_lost': Game_lost(self)
-                }
-        self.state = self.states_dict['Start_screen']
+        if headless:
+            self.states_dict = {'Ingame': Ingame(self)}
+            self.state = self.states_dict['Ingame']
+        else:
+            self.states_dict = {
+                    'Start_screen': Start_screen(self),
+                    'Options': Options(self),
+                    'Ingame': Ingame(self),
+                    'Pause_menu': Pause_menu(self),
+                    'Game_lost': Game_lost(self)
+                    }
+            self.state = self.states_dict['Start_screen']
         
         self.images = spr.load_images()
+        self.health_bars = spr.load_health_bars()
         
         self.start()
         
         self.debug_mode = False
+        # number of sprites that were not drawn in the last frame
+        self.culled = 0
+        # simulation speed multiplier and the fraction of a step that the
+        # rendering lags behind, mobs and projectiles are drawn between
+        # their last two positions by this amount
+        self.speed = st.GAME_SPEED
+        self.accumulator = 0
+        self.alpha = 1
         
     
     def start(self):
@@ -538,7 +787,14 @@ class Game:
         self.all_sprites = pg.sprite.Group()
         self.mobs = pg.sprite.Group()
         self.shooters = pg.sprite.Group()
-        self.bullets = pg.sprite.Group()
+        self.effects = pg.sprite.Group()
+        self.projectiles = spr.Projectile_manager(self)
+        self.flash_pool = spr.Pool(self, spr.Muzzle_flash)
+        self.mob_grid = mp.Spatial_grid(st.TILESIZE)
+        self.rng = random.Random(self.seed)
+        # number of simulation steps and the player actions between them
+        self.ticks = 0
+        self.recorder = rp.Recorder(self)
         
         self.game_lost = False
         self.money = st.STARTING_MONEY
@@ -546,32 +802,29 @@ class Game:
         self.current_wave = 0
         self.wave_spawner = mp.Wave(self)
         self.elapsed_seconds = 0
-        # load objects from tmx data
-        self.bg_image, map_objects = mp.load_map('level2')
-        self.roads = []
-        self.nodes = []
-        self.walls = []
-        for obj in map_objects:
-            if obj.name == 'Road':
-                self.roads.append(spr.Road(obj.x, obj.y, obj.width, obj.height))
-            elif obj.name == 'node':
-                self.nodes.append(mp.Node(self, (obj.x, obj.y), (obj.width, obj.height)))
-            elif obj.name == 'Wall':
-                self.walls.append(mp.Wall(self, (obj.x, obj.y), (obj.width, obj.height)))
-        
-        self.map_rect = self.bg_image.get_rect()
-        self.map_rect.topleft = (0, 0)
-        self.start_node = mp.Node(self, (-2 * st.TILESIZE, self.map_rect.h // 2), (64, 64))
-        self.end_node = mp.Node(self, (41 * st.TILESIZE, self.map_rect.h // 2), (64, 64))
-        self.nodes.append(self.start_node)
-        self.nodes.append(self.end_node)
-        for node in self.nodes:
-            node.find_neighbors()
-        # find paths along the nodes
-        self.paths = mp.find_paths(self.start_node, self.end_node)
+        # load objects, node graph and paths from tmx data, this only
+        # happens once, restarts reuse the map that is already loaded
+        self.map = mp.get_map('level2')
+        self.bg_image = self.map.bg_image
+        self.roads = self.map.roads
+        self.nodes = self.map.nodes
+        self.walls = self.map.walls
+        self.map_rect = self.map.rect
+        self.start_node = self.map.start_node
+        self.end_node = self.map.end_node
+        self.paths = self.map.paths
+        self.flow_field = self.map.flow_field
+        self.navigation = self.map.properties.get('navigation', st.NAVIGATION)
+        self.maze = self.map.properties.get('maze', st.MAZE_MODE)
+        if self.maze:
+            # towers change the field, so every game gets its own copy
+            self.navigation = 'flow_field'
+            self.flow_field = self.map.flow_field.copy()
               
         self.selected_shooter = next(st.shooter_it)     
         self.camera = Camera(self)
+        self.minimap = Minimap(self, (int(256 * self.ui_scale),
+                                      int(200 * self.ui_scale)))
 
 
     def load_map(self, file):
@@ -593,9 +846,16 @@ class Game:
     def events(self):
         self.mouse_pressed = [0, 0, 0, 0, 0]
         self.mouse_released = [0, 0, 0, 0, 0]
+        # mouse_pos is in screen coordinates for the camera, the menus use
+        # the position on the display
         ratio = st.SCREEN_W / st.DISPLAY_W
-        self.mouse_pos = vec(pg.mouse.get_pos()) * ratio
+        self.ui_mouse_pos = vec(pg.mouse.get_pos())
+        self.mouse_pos = self.ui_mouse_pos * ratio
         self.key_pressed = None
+        # sample the keyboard once per frame
+        self.keys = pg.key.get_pressed()
+        self.show_lifebars = (self.keys[pg.K_LSHIFT] or self.keys[pg.K_CAPSLOCK]
+                              or st.ALWAYS_SHOW_LIFEBARS)
         self.event_list = pg.event.get()
         for event in self.event_list:
             if event.type == pg.QUIT:
@@ -615,11 +875,28 @@ class Game:
             self.state.startup()
             
     
+    def create_render_target(self):
+        # the world is drawn into self.screen, which is the display itself
+        # unless st.RENDER_SCALE asks for a lower resolution
+        size = (int(st.DISPLAY_W * st.RENDER_SCALE),
+                int(st.DISPLAY_H * st.RENDER_SCALE))
+        if not self.headless and size == self.display.get_size():
+            self.screen = self.display
+        else:
+            self.screen = pg.Surface(size)
+    
+    
+    def ui_font(self, size, bold=False):
+        # font for the menus and the hud, size is for the screen size
+        return pg.font.SysFont('Arial', round(size * self.ui_scale), bold=bold)
+    
+    
     def toggle_fullscreen(self):
         if self.display.get_flags() & pg.FULLSCREEN:
-            pg.display.set_mode(st.DISPLAY_SIZE)
+            self.display = pg.display.set_mode(st.DISPLAY_SIZE)
         else:
-            pg.display.set_mode(st.DISPLAY_SIZE, pg.FULLSCREEN)
+            self.display = pg.display.set_mode(st.DISPLAY_SIZE, pg.FULLSCREEN)
+        self.create_render_target()
             
     
     def update(self, dt):  
@@ -629,32 +906,58 @@ class Game:
     
     
     def draw(self):
+        # the world is drawn with the camera zoom into the render target,
+        # the menus and the hud go straight onto the display
+        self.profiler.start('world draw')
         self.screen.fill(st.BLACK)
-        self.display.fill(st.BLACK)
-        self.state.draw(self.screen)
-        w, h = self.display.get_size()
-        if self.camera.zoom_level == 1:
-            pg.transform.scale(self.screen, (w, h), self.display)
-        else:
-            s = pg.transform.scale(self.screen, (int(w * self.camera.zoom_level),
-                                                 int(h * self.camera.zoom_level)))
-            self.display.blit(s, (0, 0))              
+        self.state.draw_world(self.screen)
+        self.profiler.start('scaling')
+        if self.screen is not self.display:
+            pg.transform.scale(self.screen, self.display.get_size(), self.display)
+        self.profiler.start('HUD draw')
+        self.state.draw(self.display)
+        if self.debug_mode:
+            self.profiler.start('overlay')
+            self.profiler.draw(self.display)
+        self.profiler.start('display update')
         pg.display.update()
+        self.profiler.next_frame()
     
     
     def draw_sprites(self, screen):
+        # only draw what is on the screen, in map coordinates
+        viewport = pg.Rect(-self.camera.offset, self.camera.view_size())
+        viewport.inflate_ip(st.CULL_MARGIN * 2, st.CULL_MARGIN * 2)
+        self.culled = 0
         for sprite in self.all_sprites:
-            sprite.draw(screen)
+            if viewport.colliderect(sprite.rect):
+                sprite.draw(self.render_queue)
+            else:
+                self.culled += 1
+        self.culled += self.projectiles.draw(self.render_queue, viewport)
+        self.render_queue.draw(screen, self.camera.scale)
     
         
     def run(self):
         self.running = True
         while self.running:
-            delta_time = self.clock.tick(st.FPS) / (1000.0 / st.GAME_SPEED)
-            if delta_time <= 0.1:
-                self.events()
-                self.switch_states()
-                self.update(delta_time)
-                self.draw()
+            frame_time = min(self.clock.tick(st.FPS) / 1000.0, st.MAX_FRAME_TIME)
+            self.profiler.start('events')
+            self.events()
+            self.switch_states()
+            self.update(frame_time)
+            # run as many fixed steps as the (sped up) frame time covers
+            self.accumulator += frame_time * self.speed
+            steps = 0
+            while self.accumulator >= st.SIM_DT:
+                if steps == st.MAX_STEPS_PER_FRAME:
+                    # can't keep up, let the game slow down instead
+                    self.accumulator = 0
+                    break
+                self.state.step(st.SIM_DT)
+                self.accumulator -= st.SIM_DT
+                steps += 1
+            self.alpha = self.accumulator / st.SIM_DT
+            self.draw()
         
         pg.quit()
\ No newline at end of file
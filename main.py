@@ -1,12 +1,22 @@
 import pygame as pg
+import argparse
 import traceback
 from game_states import Game
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seed', type=int,
+                        help='seed for the random numbers of the game')
+    parser.add_argument('--record', metavar='FILE',
+                        help='save the actions of the last game as a replay, '
+                             'see simulate.py --replay')
+    args = parser.parse_args()
     try:
-        g = Game()
+        g = Game(seed=args.seed)
         g.run()
+        if args.record:
+            g.recorder.save(args.record)
     except:
         traceback.print_exc()
-        pg.quit()
\ No newline at end of file
+        pg.quit()
@@ -1,7 +1,16 @@
 import pygame as pg
+import numpy as np
+import glob
+import hashlib
+import heapq
+import itertools
+import math
+import os
+import pickle
+from collections import deque
+from xml.etree import ElementTree
 from queue import Queue
 from pytmx.util_pygame import load_pygame
-from random import randint, choice
 
 import sprites as spr
 import settings as st
@@ -9,6 +18,9 @@ import settings as st
 
 vec = pg.math.Vector2
 
+# change this when the format of the compiled maps changes
+MAP_CACHE_VERSION = 3
+
 
 def get_path_length(path):
     # calculate the length of a given path of nodes
@@ -29,7 +41,7 @@ def breadth_first_search(start, goal):
     # visit all nodes
     while not frontier.empty():
         current = frontier.get()
-        for next in current.find_neighbors():
+        for next in current.neighbors:
             if next not in came_from:
                 frontier.put(next)
                 came_from[next] = current
@@ -44,27 +56,147 @@ def breadth_first_search(start, goal):
     return path
 
 
-def find_paths(start, goal):
-    # return all paths between nodes
-    q = Queue()
-    path = []
-    paths = []
-    path.append(start)
-    q.put(path)
-    while not q.empty():
-        path = q.get()
-        last = path[-1]
-        if last == goal:
-            paths.append(path)
-        
-        for node in last.neighbors:
-            # look at each neighbor of the current node
-            if node not in path:
-                newpath = list(path)
-                newpath.append(node)
-                q.put(newpath)
-    #return sorted(paths, key=len)
-    return sorted(paths, key=get_path_length)
+def shortest_path(start, goal, removed_nodes=(), removed_edges=()):
+    # dijkstra on the euclidean distances between the nodes, ignoring
+    # the removed nodes and edges, returns None if goal can't be reached
+    counter = itertools.count()
+    frontier = [(0, next(counter), start)]
+    cost = {start: 0}
+    came_from = {start: None}
+    while frontier:
+        dist, _, current = heapq.heappop(frontier)
+        if current == goal:
+            path = []
+            while current is not None:
+                path.append(current)
+                current = came_from[current]
+            path.reverse()
+            return path
+        if dist > cost[current]:
+            continue
+        for neighbor in current.neighbors:
+            if (neighbor in removed_nodes or
+                (current, neighbor) in removed_edges):
+                continue
+            new_cost = dist + current.position.distance_to(neighbor.position)
+            if new_cost < cost.get(neighbor, math.inf):
+                cost[neighbor] = new_cost
+                came_from[neighbor] = current
+                heapq.heappush(frontier, (new_cost, next(counter), neighbor))
+    return None
+
+
+def find_paths(start, goal, max_paths=st.MAX_PATHS):
+    # return up to max_paths shortest loopless paths between the nodes,
+    # sorted by length (Yen's algorithm)
+    # https://en.wikipedia.org/wiki/Yen%27s_algorithm
+    path = shortest_path(start, goal)
+    if path is None:
+        return []
+    paths = [path]
+    seen = {tuple(path)}
+    candidates = []
+    counter = itertools.count()
+    while len(paths) < max_paths:
+        last = paths[-1]
+        for i in range(len(last) - 1):
+            # branch off the last path at each of its nodes
+            spur = last[i]
+            root = last[:i + 1]
+            removed_edges = {(p[i], p[i + 1]) for p in paths
+                             if p[:i + 1] == root}
+            removed_nodes = set(root[:-1])
+            spur_path = shortest_path(spur, goal, removed_nodes, removed_edges)
+            if spur_path:
+                path = root[:-1] + spur_path
+                if tuple(path) not in seen:
+                    seen.add(tuple(path))
+                    heapq.heappush(candidates, (get_path_length(path),
+                                                next(counter), path))
+        if not candidates:
+            break
+        paths.append(heapq.heappop(candidates)[2])
+    return paths
+
+
+def segment_intersects_rect(x0, y0, x1, y1, rect):
+    # slab test (liang-barsky) of the segment against the rect, works on
+    # plain numbers so that it doesn't have to create any objects
+    t0 = 0.0
+    t1 = 1.0
+    dx = x1 - x0
+    if dx == 0:
+        if x0 < rect.left or x0 > rect.right:
+            return False
+    else:
+        ta = (rect.left - x0) / dx
+        tb = (rect.right - x0) / dx
+        if ta > tb:
+            ta, tb = tb, ta
+        if ta > t0:
+            t0 = ta
+        if tb < t1:
+            t1 = tb
+        if t0 > t1:
+            return False
+    dy = y1 - y0
+    if dy == 0:
+        if y0 < rect.top or y0 > rect.bottom:
+            return False
+    else:
+        ta = (rect.top - y0) / dy
+        tb = (rect.bottom - y0) / dy
+        if ta > tb:
+            ta, tb = tb, ta
+        if ta > t0:
+            t0 = ta
+        if tb < t1:
+            t1 = tb
+        if t0 > t1:
+            return False
+    return True
+
+
+def build_visibility_graph(nodes, walls):
+    # two nodes are neighbors if the line between them doesn't cross a
+    # wall or another node, every pair of nodes is only checked once and
+    # only against the obstacles in the grid cells around that line
+    grid = Spatial_grid(st.TILESIZE * 2)
+    for obstacle in walls + nodes:
+        grid.insert_rect(obstacle, obstacle.rect)
+    adjacency = {node: [] for node in nodes}
+    for a, b in itertools.combinations(nodes, 2):
+        x0, y0 = a.position
+        x1, y1 = b.position
+        for obstacle in grid.query_box(min(x0, x1), min(y0, y1),
+                                       max(x0, x1), max(y0, y1)):
+            if (obstacle is not a and obstacle is not b and
+                segment_intersects_rect(x0, y0, x1, y1, obstacle.rect)):
+                break
+        else:
+            adjacency[a].append(b)
+            adjacency[b].append(a)
+    return adjacency
+
+
+def build_flow_field(roads, walls, size, cell_size=st.FLOW_CELL_SIZE):
+    # a cell is walkable if its center is on a road and not in a wall, the
+    # exit are the walkable cells of the last column
+    field = Flow_field(cell_size, size)
+    xs = (np.arange(field.cols) + 0.5) * cell_size
+    ys = (np.arange(field.rows) + 0.5) * cell_size
+    walkable = field.walkable
+    for road in roads:
+        r = road.rect
+        walkable |= (((ys >= r.top) & (ys < r.bottom))[:, None] &
+                     ((xs >= r.left) & (xs < r.right))[None, :])
+    for wall in walls:
+        r = wall.rect
+        walkable &= ~(((ys >= r.top) & (ys < r.bottom))[:, None] &
+                      ((xs >= r.left) & (xs < r.right))[None, :])
+    goals = [(y, field.cols - 1) for y in np.flatnonzero(walkable[:, -1]).tolist()]
+    field.compute(goals)
+    return field
 
 
 def load_map(file):
@@ -73,13 +205,76 @@ def load_map(file):
         bg_image = pg.Surface((tiled_map.width * tiled_map.tilewidth,
                               tiled_map.height * tiled_map.tileheight))
         map_objects = tiled_map.get_layer_by_name('objects1')
+        # optional map settings, like 'max_paths'
+        properties = tiled_map.properties
         # iterate through each tile layer and blit the corresponding tile
         for layer in tiled_map.layers:
             if 'tiles' in layer.name:
                 for x, y, image in layer.tiles():
                     bg_image.blit(image, (x * tiled_map.tilewidth, 
                                           y * tiled_map.tileheight))
-        return bg_image, map_objects
+        return bg_image, map_objects, properties
+
+
+def map_hash(file):
+    # hash of the tmx file, its tilesets and their images, plus the settings
+    # that change the compiled result
+    paths = ['assets/{}.tmx'.format(file)]
+    for tileset in ElementTree.parse(paths[0]).getroot().iter('tileset'):
+        if 'source' in tileset.attrib:
+            tsx = os.path.join('assets', tileset.attrib['source'])
+            paths.append(tsx)
+            for image in ElementTree.parse(tsx).getroot().iter('image'):
+                paths.append(os.path.join(os.path.dirname(tsx),
+                                          image.attrib['source']))
+    sha = hashlib.sha1()
+    sha.update('{} {} {}'.format(MAP_CACHE_VERSION, st.MAX_PATHS,
+                                 st.FLOW_CELL_SIZE).encode())
+    for path in paths:
+        with open(path, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()[:16]
+
+
+# maps that were already loaded in this session, by file name
+loaded_maps = {}
+
+
+def get_map(file):
+    '''
+    returns the Map for a tmx file, from memory if it was already loaded,
+    otherwise from the compiled map cache if the tmx and its tilesets
+    haven't changed, and only if both fail by loading the tmx itself
+    '''
+    if file in loaded_maps:
+        return loaded_maps[file]
+    game_map = Map(file)
+    key = map_hash(file)
+    path = os.path.join(st.MAP_CACHE_DIR, '{}.{}.map'.format(file, key))
+    try:
+        with open(path, 'rb') as f:
+            game_map.unpack(pickle.loads(f.read()))
+    except (OSError, EOFError, pickle.UnpicklingError, KeyError, ValueError):
+        game_map = Map(file)
+        game_map.load_tmx()
+        save_compiled_map(game_map, path)
+    loaded_maps[file] = game_map
+    return game_map
+
+
+def save_compiled_map(game_map, path):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # remove compiled versions of older tmx files
+        for old in glob.glob(os.path.join(os.path.dirname(path),
+                                          '{}.*.map'.format(game_map.name))):
+            os.remove(old)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(pickle.dumps(game_map.pack(), pickle.HIGHEST_PROTOCOL))
+        os.replace(path + '.tmp', path)
+    except OSError:
+        # the cache is only an optimization, the game works without it
+        print('could not write the compiled map', path)
 
 
 
@@ -97,13 +292,17 @@ class Wave(object):
     
     def spawn_wave(self, n, dt):
         # slight random offset
-        pos = self.game.start_node.position + vec(0, randint(-1, 1))
+        pos = self.game.start_node.position + vec(0, self.game.rng.randint(-1, 1))
         # advance the timer
         self.timer += dt
         
         if not self.done and self.timer > self.delay:
             self.timer = 0
-            spr.Mob(self.game, pos, choice(self.game.paths), st.waves[n]['type'])
+            if self.game.navigation == 'paths':
+                path = self.game.rng.choice(self.game.paths)
+            else:
+                path = None
+            spr.Mob(self.game, pos, path, st.waves[n]['type'])
             self.counter += 1
             if self.counter >= st.waves[n]['number']:
                 self.counter = 0
@@ -111,12 +310,412 @@ class Wave(object):
 
 
 
+class Flow_field(object):
+    '''
+    distance to the exit and the direction towards it for every cell of a
+    grid over the map, mobs without a path look up the direction of the
+    cell they are in instead of following nodes (see sprites.steer_mobs)
+    
+    in maze mode towers block cells, set_walkable() queues the cells around
+    them and repair() updates the distances a few cells at a time (LPA*)
+    '''
+    # neighbour offsets and the length of the step
+    steps = [(dx, dy, math.hypot(dx, dy))
+             for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy]
+
+    def __init__(self, cell_size, size):
+        self.cell_size = cell_size
+        self.cols = math.ceil(size[0] / cell_size)
+        self.rows = math.ceil(size[1] / cell_size)
+        self.walkable = np.zeros((self.rows, self.cols), dtype=bool)
+        self.distance = np.full((self.rows, self.cols), np.inf)
+        self.direction = np.zeros((self.rows, self.cols, 2))
+        self.goals = []
+        self.blocked_cost = self.rows * self.cols
+        # state of the incremental repair, created by the first change
+        self.g = None
+        self.rhs = None
+        self.walk = None
+        self.queue = []
+
+
+    def neighbours(self, row, col, walkable):
+        # cells that can move to (row, col), walkable cells can't move
+        # diagonally past a blocked corner
+        for dx, dy, length in self.steps:
+            r = row + dy
+            c = col + dx
+            if 0 <= r < self.rows and 0 <= c < self.cols:
+                if (dx and dy and walkable[r][c] and
+                        not (walkable[row][c] and walkable[r][col])):
+                    continue
+                yield r, c, dx, dy, length
+
+
+    def successors(self, row, col, walkable):
+        # cells that (row, col) can move to
+        for dx, dy, length in self.steps:
+            r = row + dy
+            c = col + dx
+            if 0 <= r < self.rows and 0 <= c < self.cols:
+                if (dx and dy and walkable[row][col] and
+                        not (walkable[row][c] and walkable[r][col])):
+                    continue
+                yield r, c, dx, dy, length
+
+
+    def cell_direction(self, row, col, distance, walkable):
+        # unit vector to the successor that is closest to the goal
+        best = distance[row][col]
+        direction = (1, 0) if best == 0 else (0, 0)
+        for r, c, dx, dy, length in self.successors(row, col, walkable):
+            if distance[r][c] < best:
+                best = distance[r][c]
+                direction = (dx / length, dy / length)
+        return direction
+
+
+    def compute(self, goals):
+        # dijkstra from the goal cells, then every cell points to its
+        # neighbour that is closest to the goal
+        self.goals = goals
+        walkable = self.walkable.tolist()
+        distance = [[math.inf] * self.cols for _ in range(self.rows)]
+        frontier = []
+        for row, col in goals:
+            distance[row][col] = 0
+            frontier.append((0, row, col))
+        heapq.heapify(frontier)
+        while frontier:
+            d, row, col = heapq.heappop(frontier)
+            if d > distance[row][col]:
+                continue
+            for r, c, dx, dy, length in self.neighbours(row, col, walkable):
+                cost = length if walkable[r][c] else length * self.blocked_cost
+                if d + cost < distance[r][c]:
+                    distance[r][c] = d + cost
+                    heapq.heappush(frontier, (d + cost, r, c))
+
+        for row in range(self.rows):
+            for col in range(self.cols):
+                self.direction[row, col] = self.cell_direction(row, col, distance,
+                                                               walkable)
+        self.distance[:] = distance
+
+
+    def cell(self, pos):
+        # (row, col) of the cell that contains pos, clamped to the grid
+        col = min(max(int(pos[0] // self.cell_size), 0), self.cols - 1)
+        row = min(max(int(pos[1] // self.cell_size), 0), self.rows - 1)
+        return row, col
+
+
+    def cells_in_rect(self, rect):
+        # walkable cells with their center inside rect
+        size = self.cell_size
+        cells = []
+        for row in range(max(rect.top // size, 0), min(rect.bottom // size + 1, self.rows)):
+            for col in range(max(rect.left // size, 0), min(rect.right // size + 1, self.cols)):
+                if (self.walkable[row, col] and
+                        rect.collidepoint((col + 0.5) * size, (row + 0.5) * size)):
+                    cells.append((row, col))
+        return cells
+
+
+    def connected(self, blocked, sources):
+        # True if every source cell can still walk to the goal when the
+        # blocked cells are removed (breadth first search from the goal)
+        walkable = self.walkable.tolist()
+        for row, col in blocked:
+            walkable[row][col] = False
+        seen = set(cell for cell in self.goals if walkable[cell[0]][cell[1]])
+        frontier = deque(seen)
+        while frontier:
+            row, col = frontier.popleft()
+            for r, c, dx, dy, length in self.neighbours(row, col, walkable):
+                if walkable[r][c] and (r, c) not in seen:
+                    seen.add((r, c))
+                    frontier.append((r, c))
+        return all(cell in seen for cell in sources)
+
+
+    def set_walkable(self, cells, walkable):
+        # changes the cells and queues them and their neighbours for
+        # repair(), until then mobs keep the old directions
+        if self.g is None:
+            self.g = self.distance.tolist()
+            self.rhs = self.distance.tolist()
+            self.walk = self.walkable.tolist()
+            self.goal_set = set(self.goals)
+        for row, col in cells:
+            self.walkable[row, col] = walkable
+            self.walk[row][col] = walkable
+        changed = set()
+        for row, col in cells:
+            changed.add((row, col))
+            for dx, dy, length in self.steps:
+                if 0 <= row + dy < self.rows and 0 <= col + dx < self.cols:
+                    changed.add((row + dy, col + dx))
+        for row, col in changed:
+            self.update_cell(row, col)
+        self.update_directions(changed)
+
+
+    def update_cell(self, row, col):
+        # recomputes the distance a cell would have from its successors
+        # and queues it if that differs from its current distance
+        if (row, col) not in self.goal_set:
+            rhs = math.inf
+            factor = 1 if self.walk[row][col] else self.blocked_cost
+            for r, c, dx, dy, length in self.successors(row, col, self.walk):
+                d = self.g[r][c] + length * factor
+                if d < rhs:
+                    rhs = d
+            self.rhs[row][col] = rhs
+        g = self.g[row][col]
+        if g != self.rhs[row][col]:
+            heapq.heappush(self.queue, (min(g, self.rhs[row][col]), row, col))
+
+
+    def repair(self, budget):
+        # settles up to budget queued cells, closest to the goal first,
+        # returns the number of cells that were processed
+        processed = 0
+        changed = set()
+        while self.queue and processed < budget:
+            key, row, col = heapq.heappop(self.queue)
+            g = self.g[row][col]
+            rhs = self.rhs[row][col]
+            # skip entries that were queued again with another key
+            if g == rhs or key != min(g, rhs):
+                continue
+            processed += 1
+            if g > rhs:
+                self.g[row][col] = rhs
+            else:
+                # the cell got further away, so its neighbours have to be
+                # checked against their other successors
+                self.g[row][col] = math.inf
+                self.update_cell(row, col)
+            for r, c, dx, dy, length in self.neighbours(row, col, self.walk):
+                self.update_cell(r, c)
+                changed.add((r, c))
+            changed.add((row, col))
+        self.update_directions(changed)
+        return processed
+
+
+    def update_directions(self, cells):
+        for row, col in cells:
+            self.direction[row, col] = self.cell_direction(row, col, self.g, self.walk)
+            self.distance[row, col] = self.g[row][col]
+
+
+    def copy(self):
+        # the map and its field are shared between games, a game that
+        # blocks cells works on a copy
+        field = Flow_field(self.cell_size, (0, 0))
+        field.unpack({
+                'cell_size': self.cell_size,
+                'walkable': self.walkable.copy(),
+                'distance': self.distance.copy(),
+                'direction': self.direction.copy(),
+                'goals': list(self.goals)
+                })
+        return field
+
+
+    def lookup(self, positions):
+        # directions for an (n, 2) array of positions, positions outside of
+        # the map use the closest cell
+        cols = np.clip((positions[:, 0] // self.cell_size).astype(int),
+                       0, self.cols - 1)
+        rows = np.clip((positions[:, 1] // self.cell_size).astype(int),
+                       0, self.rows - 1)
+        return self.direction[rows, cols]
+
+
+    def pack(self):
+        return {
+                'cell_size': self.cell_size,
+                'walkable': self.walkable,
+                'distance': self.distance,
+                'direction': self.direction,
+                'goals': self.goals
+                }
+
+
+    def unpack(self, data):
+        self.cell_size = data['cell_size']
+        self.walkable = data['walkable']
+        self.distance = data['distance']
+        self.direction = data['direction']
+        self.goals = data['goals']
+        self.rows, self.cols = self.walkable.shape
+        self.blocked_cost = self.rows * self.cols
+
+
+
+class Spatial_grid(object):
+    '''
+    uniform grid that buckets objects by their position, so that
+    neighbourhood queries only have to look at a few cells
+    '''
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+
+
+    def clear(self):
+        self.cells.clear()
+
+
+    def insert(self, item, position):
+        key = (int(position[0] // self.cell_size),
+               int(position[1] // self.cell_size))
+        cell = self.cells.get(key)
+        if cell is None:
+            self.cells[key] = [item]
+        else:
+            cell.append(item)
+
+
+    def rebuild(self, sprites):
+        # put every sprite in the cell that contains its position
+        self.cells.clear()
+        for sprite in sprites:
+            self.insert(sprite, sprite.pos)
+
+
+    def insert_rect(self, item, rect):
+        # put the item in every cell that the rect overlaps
+        size = self.cell_size
+        for x in range(rect.left // size, (rect.right - 1) // size + 1):
+            for y in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                self.cells.setdefault((x, y), []).append(item)
+
+
+    def query_box(self, left, top, right, bottom):
+        # yields the items in the cells that overlap the box, an item that
+        # was inserted with insert_rect can come up more than once
+        size = self.cell_size
+        cells = self.cells
+        for x in range(int(left // size), int(right // size) + 1):
+            for y in range(int(top // size), int(bottom // size) + 1):
+                cell = cells.get((x, y))
+                if cell:
+                    yield from cell
+
+
+    def query(self, position, radius):
+        # yields every item in the cells that overlap the square
+        # around position, callers still have to check the distance
+        size = self.cell_size
+        x0 = int((position[0] - radius) // size)
+        x1 = int((position[0] + radius) // size)
+        y0 = int((position[1] - radius) // size)
+        y1 = int((position[1] + radius) // size)
+        cells = self.cells
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(cells):
+            # large radius (or few mobs), cheaper to go over the used cells
+            for (x, y), cell in cells.items():
+                if x0 <= x <= x1 and y0 <= y <= y1:
+                    yield from cell
+            return
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                cell = cells.get((x, y))
+                if cell:
+                    yield from cell
+
+
+
+class Map(object):
+    '''
+    everything that is loaded from a tmx file: the background image,
+    the roads, walls and nodes and the graph and paths for the mobs
+    '''
+    def __init__(self, file):
+        self.name = file
+        self.bg_image = None
+        self.rect = None
+        self.properties = {}
+        self.roads = []
+        self.nodes = []
+        self.walls = []
+        self.start_node = None
+        self.end_node = None
+        self.adjacency = {}
+        self.paths = []
+        self.flow_field = None
+
+
+    def load_tmx(self):
+        self.bg_image, map_objects, self.properties = load_map(self.name)
+        self.rect = self.bg_image.get_rect()
+        for obj in map_objects:
+            if obj.name == 'Road':
+                self.roads.append(spr.Road(obj.x, obj.y, obj.width, obj.height))
+            elif obj.name == 'node':
+                self.nodes.append(Node((obj.x, obj.y), (obj.width, obj.height)))
+            elif obj.name == 'Wall':
+                self.walls.append(Wall((obj.x, obj.y), (obj.width, obj.height)))
+
+        self.start_node = Node((-2 * st.TILESIZE, self.rect.h // 2), (64, 64))
+        self.end_node = Node((41 * st.TILESIZE, self.rect.h // 2), (64, 64))
+        self.nodes.append(self.start_node)
+        self.nodes.append(self.end_node)
+        self.adjacency = build_visibility_graph(self.nodes, self.walls)
+        for node in self.nodes:
+            node.neighbors = self.adjacency[node]
+        # find paths along the nodes
+        max_paths = self.properties.get('max_paths', st.MAX_PATHS)
+        self.paths = find_paths(self.start_node, self.end_node, max_paths)
+        self.flow_field = build_flow_field(self.roads, self.walls, self.rect.size)
+
+
+    def pack(self):
+        # everything as plain python data, nodes are stored as their index
+        index = {node: i for i, node in enumerate(self.nodes)}
+        return {
+                'size': self.rect.size,
+                'bg_image': pg.image.tostring(self.bg_image, 'RGB'),
+                'properties': dict(self.properties),
+                'roads': [tuple(road.rect) for road in self.roads],
+                'walls': [tuple(wall.rect) for wall in self.walls],
+                'nodes': [tuple(node.rect) for node in self.nodes],
+                'adjacency': [[index[n] for n in self.adjacency[node]]
+                              for node in self.nodes],
+                'paths': [[index[n] for n in path] for path in self.paths],
+                'flow_field': self.flow_field.pack()
+                }
+
+
+    def unpack(self, data):
+        self.bg_image = pg.image.fromstring(data['bg_image'], data['size'], 'RGB')
+        self.rect = self.bg_image.get_rect()
+        self.properties = data['properties']
+        self.roads = [spr.Road(*rect) for rect in data['roads']]
+        self.walls = [Wall(rect[:2], rect[2:]) for rect in data['walls']]
+        self.nodes = [Node(rect[:2], rect[2:]) for rect in data['nodes']]
+        # start and end node are always the last two
+        self.start_node = self.nodes[-2]
+        self.end_node = self.nodes[-1]
+        self.adjacency = {}
+        for node, neighbors in zip(self.nodes, data['adjacency']):
+            node.neighbors = [self.nodes[i] for i in neighbors]
+            self.adjacency[node] = node.neighbors
+        self.paths = [[self.nodes[i] for i in path] for path in data['paths']]
+        self.flow_field = Flow_field(st.FLOW_CELL_SIZE, self.rect.size)
+        self.flow_field.unpack(data['flow_field'])
+
+
+
 class Node:
     '''
     this object represents a position on the map
     '''
-    def __init__(self, game, position, size):
-        self.game = game
+    def __init__(self, position, size):
         self.rect = pg.Rect(position, size)
         self.rect.topleft = position
         self.position = vec(self.rect.center)
@@ -125,84 +724,13 @@ class Node:
     
     def __repr__(self):
         return str(self.position)
-        
-    
-    def find_neighbors(self):
-        # cast a ray to each other node and if it doesn't intersect a wall
-        # or another node and add that node to its neighbors
-        self.neighbors.clear()
-        for node in self.game.nodes:
-            if node != self:
-                dist = Line(self.position, node.position)
-                intersects = False
-                for wall in self.game.walls:
-                    if dist.intersects_rect(wall.rect):
-                        intersects = True
-                for other in self.game.nodes:
-                    if (other != self and other != node and
-                        dist.intersects_rect(other.rect)):
-                        intersects = True
-                if not intersects:
-                    self.neighbors.append(node)
-        return self.neighbors
     
 
 class Wall:
     '''
     'Wall' is everywhere the mobs can't go through
     '''
-    def __init__(self, game, position, size):
-        self.game = game
+    def __init__(self, position, size):
         self.rect = pg.Rect(position, size)
         self.rect.topleft = position
         self.position = vec(position)
-    
-                
-
-class Line:
-    '''
-    class that represents a line from one point to another
-    '''
-    def __init__(self, start, end):
-        self.start = vec(start)
-        self.end = vec(end)
-        
-    
-    def intersects_line(self, other):
-        # checks if two Line objects intersect
-        #http://www.jeffreythompson.org/collision-detection/line-rect.php
-        # calculate denominators for uA and uB
-        denA = ((other.end.y - other.start.y) * (self.end.x - self.start.x) - 
-                (other.end.x - other.start.x) * (self.end.y - self.start.y))
-        denB = ((other.end.y - other.start.y) * (self.end.x - self.start.x) - 
-                (other.end.x - other.start.x) * (self.end.y - self.start.y))
-        if denA == 0 or denB == 0:
-            # if any denominator is 0, the lines are parallel and don't intersect
-            return False
-        else:
-            # calculate numerators for uA and uB
-            numA = ((other.end.x - other.start.x) * (self.start.y - other.start.y) - 
-                    (other.end.y - other.start.y) * (self.start.x - other.start.x))
-            numB = ((self.end.x - self.start.x) * (self.start.y - other.start.y) - 
-                    (self.end.y - self.start.y) * (self.start.x - other.start.x))
-            uA = numA / denA
-            uB = numB / denB
-            return (uA >= 0 and uA <= 1 and uB >= 0 and uB <= 1)
-
-    
-    def get_lines_from_rect(self, rect):
-        # returns a list with all 4 sides of a given rect as Line objects
-        l1 = Line(rect.topleft, rect.topright)
-        l2 = Line(rect.topright, rect.bottomright)
-        l3 = Line(rect.bottomright, rect.bottomleft)
-        l4 = Line(rect.bottomleft, rect.topleft)
-        return [l1, l2, l3, l4]
-
-    
-    def intersects_rect(self, rect):
-        # checks if this line intersects any lines from a given rect
-        lines = self.get_lines_from_rect(rect)
-        for line in lines:
-            if self.intersects_line(line):
-                return True
-        return False
\ No newline at end of file
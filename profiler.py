@@ -0,0 +1,117 @@
+import pygame as pg
+import time
+from collections import deque
+
+import settings as st
+
+
+# surfaces created by the game itself, the places that create surfaces
+# while playing call count_allocation()
+allocations = 0
+
+
+def count_allocation(n=1):
+    global allocations
+    allocations += n
+
+
+
+class Profiler(object):
+    '''
+    measures how long the phases of each frame take and draws them as
+    rolling graphs in debug mode, start() ends the phase that is running
+    '''
+    phases = ['events', 'mob update', 'shooter update', 'projectile update',
+              'waves', 'world draw', 'HUD draw', 'overlay', 'scaling',
+              'display update']
+    # graph height in ms, one frame at the target frame rate
+    budget = 1000 / st.FPS
+
+    def __init__(self, game, length=120):
+        self.game = game
+        self.length = length
+        self.times = dict.fromkeys(self.phases, 0)
+        self.history = {name: deque([0] * length, maxlen=length)
+                        for name in self.phases}
+        self.allocations = deque([0] * length, maxlen=length)
+        self.last_allocations = allocations
+        self.phase = None
+        self.started = 0
+        self.font = pg.font.SysFont(st.FONT, 14)
+        # rendered names of the graphs, they never change
+        self.labels = {}
+
+
+    def start(self, phase):
+        now = time.perf_counter()
+        if self.phase:
+            self.times[self.phase] += now - self.started
+        self.phase = phase
+        self.started = now
+
+
+    def stop(self):
+        self.start(None)
+
+
+    def next_frame(self):
+        # moves the times of the finished frame into the history
+        self.stop()
+        for name in self.phases:
+            self.history[name].append(self.times[name] * 1000)
+            self.times[name] = 0
+        self.allocations.append(allocations - self.last_allocations)
+        self.last_allocations = allocations
+
+
+    def draw(self, screen):
+        # below the minimap
+        x = screen.get_width() - self.length - 150
+        y = self.game.minimap.size[1] + 20
+        panel = pg.Rect(x - 10, y - 10, self.length + 160, 
+                        len(self.phases) * 28 + 150)
+        screen.fill((0, 0, 0), panel)
+        for name in self.phases:
+            self.draw_graph(screen, name, self.history[name], self.budget,
+                            '{:.2f} ms', (x, y))
+            y += 28
+        self.draw_graph(screen, 'surfaces', self.allocations,
+                        max(max(self.allocations), 1), '{}', (x, y))
+        y += 36
+
+        projectiles = self.game.projectiles
+        counts = [
+                ('mobs', len(self.game.mobs)),
+                ('shooters', len(self.game.shooters)),
+                ('projectiles', projectiles.count),
+                ('flashes', self.game.flash_pool.in_use()),
+                ('all sprites', len(self.game.all_sprites)),
+                ('culled', self.game.culled)
+                ]
+        for name, count in counts:
+            self.draw_text(screen, '{}: {}'.format(name, count), (x, y))
+            y += 18
+
+
+    def draw_graph(self, screen, name, values, scale, fmt, pos):
+        x, y = pos
+        h = 20
+        if name not in self.labels:
+            self.labels[name] = self.render(name)
+        screen.blit(self.labels[name], (x, y))
+        self.draw_text(screen, fmt.format(values[-1]), (x + 90, y))
+        rect = pg.Rect(x + 140, y, self.length, h)
+        pg.draw.rect(screen, (40, 40, 40), rect)
+        points = [(rect.x + i, rect.bottom - min(h, v / scale * h))
+                  for i, v in enumerate(values)]
+        pg.draw.lines(screen, (100, 200, 100), False, points)
+
+
+    def render(self, text):
+        # the overlay's own surfaces count too
+        count_allocation()
+        return self.font.render(text, False, st.WHITE)
+
+
+    def draw_text(self, screen, text, pos):
+        screen.blit(self.render(text), pos)
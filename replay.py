@@ -0,0 +1,82 @@
+import hashlib
+import pygame as pg
+
+import settings as st
+
+vec = pg.math.Vector2
+
+REPLAY_VERSION = 1
+# argument types of the actions that can be recorded
+ACTIONS = {
+        'place': (str, float, float),
+        'sell': (float, float),
+        'select': (str,)
+        }
+
+
+class Recorder(object):
+    '''
+    remembers the actions of the player together with the simulation step
+    (game.ticks) they happened before, so that a game can be replayed
+    with simulate.py
+    '''
+    def __init__(self, game):
+        self.game = game
+        self.actions = []
+
+
+    def record(self, action, *args):
+        self.actions.append((self.game.ticks, action) + args)
+
+
+    def save(self, path):
+        # a header line, then one action per line: tick, name, arguments
+        with open(path, 'w') as f:
+            f.write('AwesomeTD replay {} seed {} dt {!r}\n'.format(
+                    REPLAY_VERSION, self.game.seed, st.SIM_DT))
+            for action in self.actions:
+                f.write(' '.join(str(x) for x in action) + '\n')
+
+
+
+def load_replay(path):
+    # returns the seed, the step size and the list of recorded actions
+    with open(path) as f:
+        header = f.readline().split()
+        if header[:3] != ['AwesomeTD', 'replay', str(REPLAY_VERSION)]:
+            raise ValueError('{} is not a version {} replay'.format(
+                    path, REPLAY_VERSION))
+        seed = int(header[4])
+        dt = float(header[6])
+        actions = []
+        for line in f:
+            tick, action, *args = line.split()
+            args = tuple(t(arg) for t, arg in zip(ACTIONS[action], args))
+            actions.append((int(tick), action) + args)
+    return seed, dt, actions
+
+
+def apply_action(game, action, *args):
+    # does the same as the player input in Ingame.update
+    ingame = game.states_dict['Ingame']
+    if action == 'place':
+        type_, x, y = args
+        ingame.place_shooter(vec(x, y), type_)
+    elif action == 'sell':
+        ingame.sell_shooter(vec(args))
+    elif action == 'select':
+        game.selected_shooter = args[0]
+
+
+def state_hash(game):
+    '''
+    short checksum of the simulation state, two runs with the same seed
+    and actions have to end up with the same hash
+    '''
+    n = game.projectiles.count
+    state = (game.ticks, game.lives, game.money, game.current_wave,
+             [(m.type, m.pos.x, m.pos.y, m.vel.x, m.vel.y, m.hp)
+              for m in game.mobs],
+             [(s.type, s.pos.x, s.pos.y) for s in game.shooters],
+             game.projectiles.pos[:n].tobytes())
+    return hashlib.sha1(repr(state).encode()).hexdigest()[:16]
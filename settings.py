@@ -15,14 +15,60 @@ DISPLAY_W = DISPLAY_SIZE[0]
 DISPLAY_H = DISPLAY_SIZE[1]
 TILESIZE = 64
 FPS = 60
+# degrees between the cached rotations of an image
+ROTATION_STEP = 3
+# the simulation always advances in steps of SIM_DT seconds, no matter how
+# fast frames are rendered, see Game.run
+SIM_DT = 1 / FPS
+# longer frames are clamped so that a hiccup doesn't freeze the game while
+# it catches up, and at most this many steps are run per frame
+MAX_FRAME_TIME = 0.25
+MAX_STEPS_PER_FRAME = 32
+# the world is rendered at this fraction of the display resolution and
+# then scaled up, lower it on slow machines
+RENDER_SCALE = 1
+# mouse wheel zoom levels
+ZOOM_LEVELS = [0.5, 0.75, 1, 1.5, 2]
+# how many pixels the zoomed copies of the images may take up in total
+SCALE_CACHE_PIXELS = 4096 * 4096
 GAME_SPEED = 1
+# in game speed hotkeys
+GAME_SPEEDS = {
+        pg.K_1: 1,
+        pg.K_2: 2,
+        pg.K_3: 4,
+        pg.K_4: 8
+        }
 FONT = 'Arial'
 
 # gameplay settings
 # MEMO make this a dict, these aren't constants
 CAMERA_SPEED = 800
+# sprites this far outside of the screen are still drawn, so that big
+# rotated images don't pop in at the edges
+CULL_MARGIN = 64
 ALWAYS_SHOW_LIFEBARS = True
 
+# how many of the shortest paths the mobs can choose from, a map can
+# override this with a 'max_paths' property in its tmx file
+MAX_PATHS = 8
+# how the mobs find the exit: 'paths' (each mob follows one of the shortest
+# paths along the nodes) or 'flow_field' (every mob walks downhill on a
+# distance field of the whole map), a map can override this with a
+# 'navigation' property in its tmx file
+NAVIGATION = 'paths'
+# cell size of the flow field grid in pixels
+FLOW_CELL_SIZE = 32
+# maze mode: towers can be placed on the roads and the mobs walk around
+# them, placements that would cut the mobs off from the exit are rejected,
+# maps can turn it on with a 'maze' property (this implies 'flow_field')
+MAZE_MODE = False
+# flow field cells that are repaired per simulation step after a tower was
+# placed or sold in maze mode
+FLOW_REPAIR_BUDGET = 256
+# compiled maps are stored here, see maps.get_map
+MAP_CACHE_DIR = 'cache'
+
 STARTING_MONEY = 1400
 STARTING_LIVES = 40
 
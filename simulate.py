@@ -0,0 +1,92 @@
+import argparse
+import json
+import time
+
+import settings as st
+import replay as rp
+from game_states import Game
+
+
+def load_layout(path):
+    # a layout is a json list of towers like {"type": "standard",
+    # "pos": [x, y]} with an optional "time", the elapsed second from
+    # which on the tower may be placed
+    with open(path) as f:
+        towers = json.load(f)
+    return sorted(towers, key=lambda tower: tower.get('time', 0))
+
+
+def run_simulation(game, layout, dt=st.SIM_DT, max_time=3600, actions=()):
+    '''
+    plays all waves in settings.waves without drawing anything and as fast
+    as possible, the towers of the layout are placed in their order as soon
+    as their time has come and there is enough money for them, recorded
+    actions (see replay.py) are applied before the step they were made in
+    '''
+    ingame = game.states_dict['Ingame']
+    pending = list(layout)
+    actions = list(actions)
+    next_action = 0
+    placed = 0
+    rejected = 0
+    last_wave = len(st.waves) - 1
+    start = time.perf_counter()
+    while game.elapsed_seconds < max_time:
+        while pending and game.elapsed_seconds >= pending[0].get('time', 0):
+            tower = pending[0]
+            if game.money < st.shooters[tower['type']]['price']:
+                break
+            if ingame.place_shooter(tower['pos'], tower['type']):
+                placed += 1
+            else:
+                rejected += 1
+            pending.pop(0)
+        while (next_action < len(actions) and
+               actions[next_action][0] <= game.ticks):
+            rp.apply_action(game, *actions[next_action][1:])
+            next_action += 1
+        ingame.step(dt)
+        if game.lives <= 0:
+            break
+        if game.current_wave >= last_wave and not game.mobs:
+            break
+    return {
+            'won': game.lives > 0,
+            'lives': game.lives,
+            'money': game.money,
+            'waves': game.current_wave,
+            'towers': placed,
+            'rejected': rejected,
+            'state_hash': rp.state_hash(game),
+            'simulated_seconds': round(game.elapsed_seconds, 2),
+            'wall_time': round(time.perf_counter() - start, 3)
+            }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description='plays all waves without a window and without a '
+                        'frame cap and prints the result')
+    parser.add_argument('--layout', help='json file with the towers to place')
+    parser.add_argument('--replay', help='replay file recorded by main.py')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed for the random numbers (default: 0)')
+    parser.add_argument('--dt', type=float, default=st.SIM_DT,
+                        help='simulated seconds per step (default: SIM_DT)')
+    parser.add_argument('--max-time', type=float, default=3600,
+                        help='stop after this many simulated seconds')
+    args = parser.parse_args()
+
+    seed, dt, actions = args.seed, args.dt, []
+    if args.replay:
+        seed, dt, actions = rp.load_replay(args.replay)
+    game = Game(headless=True, seed=seed)
+    layout = load_layout(args.layout) if args.layout else []
+    result = run_simulation(game, layout, dt, args.max_time, actions)
+    print('{}  lives: {}  money: {}  waves: {}  towers: {} ({} rejected)'.format(
+            'won' if result['won'] else 'lost', result['lives'],
+            result['money'], result['waves'], result['towers'],
+            result['rejected']))
+    print('simulated {}s in {}s, state hash {}'.format(
+            result['simulated_seconds'], result['wall_time'],
+            result['state_hash']))
@@ -1,9 +1,12 @@
 import pygame as pg
+import numpy as np
 import math
-import sys
-from random import randrange
+import os
+from collections import OrderedDict
+from xml.etree import ElementTree
 
 import settings as st
+import profiler as prof
 
 vec = pg.math.Vector2
 vec3 = pg.math.Vector3
@@ -33,6 +36,51 @@ def constrain(n, low, high):
     return max(min(n, high), low)
 
 
+def limit_rows(vectors, length):
+    # same as limit(), but for every row of an (n, 2) array
+    lengths = np.hypot(vectors[:, 0], vectors[:, 1])
+    too_long = lengths > length
+    vectors[too_long] *= (length / lengths[too_long])[:, None]
+
+
+def neighbour_pairs(a, b, cell_size):
+    '''
+    returns the indices (i, j) of all pairs of points a[i] and b[j] that
+    lie in the same or in neighbouring cells of a grid with the given
+    cell size, so callers only have to check the distances of those
+    '''
+    cells_a = np.floor(a / cell_size).astype(np.int64)
+    cells_b = np.floor(b / cell_size).astype(np.int64)
+    # turn the cell coordinates into one sortable key, with enough room
+    # on the y axis that the neighbouring keys can't wrap around
+    y_min = min(cells_a[:, 1].min(), cells_b[:, 1].min()) - 1
+    span = max(cells_a[:, 1].max(), cells_b[:, 1].max()) - y_min + 2
+    keys_a = cells_a[:, 0] * span + cells_a[:, 1] - y_min
+    keys_b = cells_b[:, 0] * span + cells_b[:, 1] - y_min
+    order = np.argsort(keys_b, kind='stable')
+    sorted_keys = keys_b[order]
+
+    indices_a = []
+    indices_b = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            keys = keys_a + dx * span + dy
+            low = np.searchsorted(sorted_keys, keys, 'left')
+            counts = np.searchsorted(sorted_keys, keys, 'right') - low
+            total = counts.sum()
+            if total == 0:
+                continue
+            # every point in a is paired with each point in that cell
+            starts = np.cumsum(counts) - counts
+            offsets = np.arange(total) - np.repeat(starts, counts)
+            indices_a.append(np.repeat(np.arange(len(a)), counts))
+            indices_b.append(order[np.repeat(low, counts) + offsets])
+    if not indices_a:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+    return np.concatenate(indices_a), np.concatenate(indices_b)
+
+
 def scale_image(image, scale):
     rect = image.get_rect()
     return pg.transform.scale(image, (rect.w * scale, rect.h * scale))
@@ -47,32 +95,259 @@ def load_image(path, scale=1, alpha=True):
     return image
 
 
+rotation_cache = {}
+fade_cache = {}
+# number of alpha values that faded images are rounded to
+FADE_LEVELS = 16
+
+
+def rotation_step(angle):
+    return int(round(angle / st.ROTATION_STEP)) % (360 // st.ROTATION_STEP)
+
+
+def rotated_image(images, name, angle):
+    # returns a shared, rotated version of images[name]
+    # angles are rounded to st.ROTATION_STEP degrees, so every image only
+    # gets rotated once per step and the sprites don't need their own copy
+    step = rotation_step(angle)
+    key = (name, step)
+    image = rotation_cache.get(key)
+    if image is None:
+        image = pg.transform.rotate(images[name], step * st.ROTATION_STEP)
+        prof.count_allocation()
+        rotation_cache[key] = image
+    return image
+
+
+def faded_image(images, name, angle, alpha):
+    # like rotated_image, but with the alpha (rounded to FADE_LEVELS values)
+    # baked into the image, so sprites sharing it can fade independently
+    level = min(int(alpha) * FADE_LEVELS // 256, FADE_LEVELS - 1)
+    key = (name, rotation_step(angle), level)
+    image = fade_cache.get(key)
+    if image is None:
+        image = rotated_image(images, name, angle).copy()
+        image.set_alpha((level + 1) * 256 // FADE_LEVELS - 1)
+        prof.count_allocation()
+        fade_cache[key] = image
+    return image
+
+
+
+class Scale_cache(object):
+    '''
+    scaled copies of images for the zoom levels, the least recently used
+    ones are dropped when all of them together have more than max_pixels
+    '''
+    def __init__(self, max_pixels=st.SCALE_CACHE_PIXELS):
+        self.images = OrderedDict()
+        self.pixels = 0
+        self.max_pixels = max_pixels
+
+
+    def get(self, image, scale, area=None):
+        # area is the part of the image to scale, as a tuple
+        key = (image, scale, area)
+        scaled = self.images.get(key)
+        if scaled is not None:
+            self.images.move_to_end(key)
+            return scaled
+        if area:
+            image = image.subsurface(area)
+        w, h = image.get_size()
+        scaled = pg.transform.scale(image, (math.ceil(w * scale),
+                                            math.ceil(h * scale)))
+        prof.count_allocation()
+        self.images[key] = scaled
+        self.pixels += scaled.get_width() * scaled.get_height()
+        while self.pixels > self.max_pixels and len(self.images) > 1:
+            old = self.images.popitem(last=False)[1]
+            self.pixels -= old.get_width() * old.get_height()
+        return scaled
+
+
+
+class Render_queue(object):
+    '''
+    collects everything that is drawn in a frame by layer and draws each
+    layer with a single Surface.blits call, the layers are drawn in this
+    order no matter in which order the sprites add their images
+    '''
+    layers = ('ground', 'tower bases', 'mobs', 'turrets', 'projectiles',
+              'effects', 'health bars', 'preview')
+    # images bigger than this (the map) are scaled in chunks of this size,
+    # and only the chunks that are on the screen
+    chunk_size = 256
+
+    def __init__(self):
+        self.blits = {layer: [] for layer in self.layers}
+        self.scaled = Scale_cache()
+
+
+    def add(self, layer, image, position, special_flags=0):
+        # positions are in render coordinates, see Camera.apply_pos
+        if special_flags:
+            self.blits[layer].append((image, position, None, special_flags))
+        else:
+            self.blits[layer].append((image, position))
+
+
+    def extend(self, layer, blits):
+        self.blits[layer].extend(blits)
+
+
+    def draw(self, screen, scale=1):
+        # the images are drawn scaled by scale
+        for layer in self.layers:
+            blits = self.blits[layer]
+            if blits:
+                if scale != 1:
+                    screen.blits(self.scale_blits(blits, scale, screen), False)
+                else:
+                    screen.blits(blits, False)
+                blits.clear()
+
+
+    def scale_blits(self, blits, scale, screen):
+        scaled = []
+        size = self.chunk_size
+        for blit in blits:
+            image, (x, y) = blit[0], blit[1]
+            w, h = image.get_size()
+            if w <= size and h <= size:
+                scaled.append((self.scaled.get(image, scale), (x, y)) + blit[2:])
+                continue
+            # chunks that overlap the screen
+            step = size * scale
+            first_x = max(0, int(-x // step))
+            first_y = max(0, int(-y // step))
+            last_x = min(math.ceil(w / size), int((screen.get_width() - x) // step) + 1)
+            last_y = min(math.ceil(h / size), int((screen.get_height() - y) // step) + 1)
+            image_rect = image.get_rect()
+            for cx in range(first_x, last_x):
+                for cy in range(first_y, last_y):
+                    area = pg.Rect(cx * size, cy * size, size, size).clip(image_rect)
+                    chunk = self.scaled.get(image, scale, tuple(area))
+                    scaled.append((chunk, (math.floor(x + cx * step),
+                                           math.floor(y + cy * step))) + blit[2:])
+        return scaled
+
+
+def health_colors():
+    # lookup table with the health bar colour for each hp percentage,
+    # from red (0) over yellow (50) to green (100)
+    colors = []
+    for i in range(101):
+        pct = i / 100
+        if pct > 0.5:
+            lerp_pct = remap(pct, 0.5, 1, 0, 1)
+            color = st.COLOR.yellow.lerp(st.COLOR.green, lerp_pct)
+        else:
+            lerp_pct = remap(pct, 0, 0.5, 0, 1)
+            color = st.COLOR.red.lerp(st.COLOR.yellow, lerp_pct)
+        colors.append(tuple(int(c) for c in color))
+    return colors
+
+
+def load_health_bars(width=40, height=6):
+    # pre-rendered health bars, indexed by hp percentage
+    bars = []
+    for i, color in enumerate(health_colors()):
+        bar = pg.Surface((int(width * i / 100), height))
+        bar.fill(color)
+        bars.append(bar)
+    return bars
+
+
 # ----------- sprites ---------------------------------------------------------
-module_dict = sys.modules[__name__].__dict__
+
+class Atlas(object):
+    '''
+    tileset from a tiled .tsx file, the tileset image is decoded once and
+    the tiles are cut out of it as subsurfaces the first time they're used
+    '''
+    def __init__(self, path):
+        root = ElementTree.parse(path).getroot()
+        self.tilewidth = int(root.attrib['tilewidth'])
+        self.tileheight = int(root.attrib['tileheight'])
+        self.tilecount = int(root.attrib['tilecount'])
+        self.columns = int(root.attrib['columns'])
+        self.spacing = int(root.attrib.get('spacing', 0))
+        self.margin = int(root.attrib.get('margin', 0))
+        source = root.find('image').attrib['source']
+        self.sheet = load_image(os.path.join(os.path.dirname(path), source))
+        # (tile id, scale): surface
+        self.tiles = {}
+
+
+    def get(self, tile_id, scale=1):
+        key = (tile_id, scale)
+        tile = self.tiles.get(key)
+        if tile is None:
+            if scale != 1:
+                # scaled variants are made once from the unscaled tile
+                tile = scale_image(self.get(tile_id), scale)
+            else:
+                x = (self.margin + (tile_id % self.columns) *
+                     (self.tilewidth + self.spacing))
+                y = (self.margin + (tile_id // self.columns) *
+                     (self.tileheight + self.spacing))
+                tile = self.sheet.subsurface((x, y, self.tilewidth,
+                                              self.tileheight))
+            prof.count_allocation()
+            self.tiles[key] = tile
+        return tile
+
+
+
+class Image_library(dict):
+    '''
+    dict of all images by name, an image is only loaded from the atlas
+    (or its own file) the first time it is looked up
+    '''
+    def __init__(self, atlas):
+        super().__init__()
+        self.atlas = atlas
+
+
+    def __missing__(self, name):
+        if name in image_tiles:
+            image = self.atlas.get(*image_tiles[name])
+        else:
+            image = load_image(*image_files[name])
+            prof.count_allocation()
+        self[name] = image
+        return image
+
+
+# image name: (tile id in towerdefense.tsx, scale)
+image_tiles = {
+        'tower1': (249, 1),
+        'tower2': (250, 1),
+        'tower3': (204, 1),
+        'towerbase1': (180, 1),
+        'towerbase2': (181, 1),
+        'mob1': (245, 1),
+        'mob2': (246, 1),
+        'mob3': (247, 1),
+        'mob4': (248, 1),
+        'mob5': (270, 1),
+        'mob6': (271, 1),
+        'mob7': (268, 1),
+        'bullet1': (272, 1),
+        'rocket1': (251, 1),
+        'flash1': (295, 1)
+        }
+
+# images that are not part of the tileset: (path, scale)
+image_files = {
+        'title_screen': ('assets/title_screen.png', 1),
+        'mob8': ('assets/single_images/towerDefense_tile1001.png', 2)
+        }
 
 
 def load_images():
-    images = {
-            'title_screen': load_image('assets/title_screen.png'),
-            'tower1': load_image('assets/single_images/towerDefense_tile249.png'),
-            'tower2': load_image('assets/single_images/towerDefense_tile250.png'),
-            'tower3': load_image('assets/single_images/towerDefense_tile204.png'),
-            'towerbase1': load_image('assets/single_images/towerDefense_tile180.png'),
-            'towerbase2': load_image('assets/single_images/towerDefense_tile181.png'),
-            'mob1': load_image('assets/single_images/towerDefense_tile245.png'),
-            'mob2': load_image('assets/single_images/towerDefense_tile246.png'),
-            'mob3': load_image('assets/single_images/towerDefense_tile247.png'),
-            'mob4': load_image('assets/single_images/towerDefense_tile248.png'),
-            'mob5': load_image('assets/single_images/towerDefense_tile270.png'),
-            'mob6': load_image('assets/single_images/towerDefense_tile271.png'),
-            'mob7': load_image('assets/single_images/towerDefense_tile268.png'),
-            'mob8': load_image('assets/single_images/towerDefense_tile1001.png', scale=2),
-            'bullet1': load_image('assets/single_images/towerDefense_tile272.png'),
-            'rocket1': load_image('assets/single_images/towerDefense_tile251.png'),
-            'flash1': load_image('assets/single_images/towerDefense_tile295.png')
-            }
-    
-    return images
+    return Image_library(Atlas('assets/towerdefense.tsx'))
 
 
 
@@ -81,39 +356,36 @@ class Mob(pg.sprite.Sprite):
         super().__init__(game.all_sprites, game.mobs)
         self.game = game
         self.type = type_
-        self.image_original = self.game.images[st.mobs[self.type]['image']].copy()
-        self.image = self.image_original.copy()
+        self.image_name = st.mobs[self.type]['image']
+        self.image = self.game.images[self.image_name]
         self.rect = self.image.get_rect()
         self.hitbox = pg.Rect((0, 0), st.mobs[self.type]['hitbox_size'])
         
-        self.health_bar = pg.Surface((40, 6))
-        self.health_bar.fill(st.GREEN)
+        self.health_bar = self.game.health_bars[100]
         self.health_bar_rect = self.health_bar.get_rect()
         
-        self.acc = vec()
         self.vel = vec()
         self.pos = vec(position)
+        # position before the last step, for drawing between the two
+        self.prev_pos = vec(position)
         self.rect.center = self.pos
         self.hitbox.center = self.rect.center
         self.path = path
         self.current_target = 0
-        self.target = self.path[self.current_target]
+        # mobs without a path follow the flow field, see steer_mobs
+        self.target = self.path[self.current_target] if path else None
         self.speed = st.mobs[self.type]['speed']
         self.friction = 0.9
         
         self.max_hp = st.mobs[self.type]['hp']
         self.hp = self.max_hp
+        # hp value that the current health bar shows
+        self.health_bar_hp = self.hp
         self.reward = st.mobs[self.type]['reward']
         
     
     def update(self, dt):
-        self.acc += self.arrive(self.target.position)
-        self.acc += self.separation()
-        self.vel += self.acc * self.speed * dt
-        self.acc *= 0
-        self.vel *= self.friction
-        self.pos += self.vel
-        
+        # the movement has already been done for all mobs by steer_mobs()
         if self.pos.x > self.game.map_rect.w:
             self.kill()
             self.game.lives -= 1
@@ -121,89 +393,101 @@ class Mob(pg.sprite.Sprite):
             self.game.money += self.reward
             self.kill()
         
-        d = self.target.position - self.pos
-        
-        if d.length() < self.speed:
-            self.current_target += 1
-            try:
-                self.target = self.path[self.current_target]
-            except:
-                self.kill()
+        if self.target:
+            d = self.target.position - self.pos
+            if d.length() < self.speed:
+                self.current_target += 1
+                try:
+                    self.target = self.path[self.current_target]
+                except:
+                    self.kill()
         
         # calculate rotation
         angle = self.vel.angle_to(RIGHT)
-        self.image = pg.transform.rotate(self.image_original.copy(), angle)
+        self.image = rotated_image(self.game.images, self.image_name, angle)
         self.rect = self.image.get_rect()
         
         self.rect.center = self.pos
         self.hitbox.center = self.rect.center  
         
     
-    def arrive(self, target):
-        # make the mob move to a target position
-        desired = target - self.pos
-        d = desired.length()
-        if d > 0:
-            desired = desired.normalize()    
-        radius = 100
-        
-        if d < radius:
-            m = remap(d, 0, radius, 0, self.speed)
-            desired *= m       
-        else:
-            desired *= self.speed
-        
-        # calculate steering force
-        steering = desired - self.vel
-        limit(steering, 1)
-        
-        return steering
-
-
-    def separation(self):
-        perception_radius = 40
-        steering = vec()
-        total = 0
-        for other in self.game.mobs:
-            if other != self:
-                d = self.pos - other.pos
-                dist = d.length()
-                if dist < perception_radius:
-                    if dist > 0:
-                        d /= (dist * dist)
-                    else:
-                        d /= 0.001
-                    steering += d
-                    total += 1      
-        if total > 0 and steering.length() > 0:
-            try:
-                steering /= total
-                steering.scale_to_length(self.speed)
-                steering -= self.vel
-                limit(steering, 0.2)
-            except:
-                print('steering went wrong', steering)
-            
-        return steering
-    
-    
-    def draw(self, screen):
-        screen.blit(self.image, self.game.camera.apply_pos(self.rect.topleft))
+    def draw(self, queue):
+        # interpolate between the last two steps
+        lag = (self.pos - self.prev_pos) * (self.game.alpha - 1)
+        queue.add('mobs', self.image,
+                  self.game.camera.apply_pos(self.rect.topleft + lag))
         
-        keys = pg.key.get_pressed()
-        if keys[pg.K_LSHIFT] or keys[pg.K_CAPSLOCK] or st.ALWAYS_SHOW_LIFEBARS:
-            pct = max(0, self.hp / self.max_hp)
-            if pct > 0.5:
-                lerp_pct = remap(pct, 0.5, 1, 0, 1)
-                self.color = st.COLOR.yellow.lerp(st.COLOR.green, lerp_pct)
-            else:
-                lerp_pct = remap(pct, 0, 0.5, 0, 1)
-                self.color = st.COLOR.red.lerp(st.COLOR.yellow, lerp_pct)
-            self.health_bar.fill(self.color)
-            self.health_bar = pg.transform.scale(self.health_bar, (int(40 * pct), 6))
-            self.health_bar_rect = self.health_bar.get_rect()
+        if self.game.show_lifebars:
+            if self.hp != self.health_bar_hp:
+                # only pick a new bar when the hp has changed
+                self.health_bar_hp = self.hp
+                pct = max(0, self.hp / self.max_hp)
+                self.health_bar = self.game.health_bars[int(pct * 100)]
+                self.health_bar_rect.size = self.health_bar.get_size()
             self.health_bar_rect.center = self.rect.center
-            screen.blit(self.health_bar, self.game.camera.apply_rect(self.health_bar_rect))
+            queue.add('health bars', self.health_bar,
+                      self.game.camera.apply_pos(self.health_bar_rect.topleft + lag))
+
+
+def steer_mobs(game, dt):
+    '''
+    moves the whole wave in one go: computes the arrive and separation
+    forces of every mob with numpy and integrates them the same way as
+    a single mob would (acc * speed * dt, then friction)
+    '''
+    mobs = game.mobs.sprites()
+    if not mobs:
+        return
+    nan = math.nan
+    data = np.array([(m.pos.x, m.pos.y, m.vel.x, m.vel.y,
+                      m.target.position.x if m.target else nan,
+                      m.target.position.y if m.target else nan,
+                      m.speed, m.friction) for m in mobs])
+    pos = data[:, 0:2]
+    vel = data[:, 2:4]
+    target = data[:, 4:6]
+    speed = data[:, 6]
+    friction = data[:, 7]
+
+    # arrive: full speed towards the target, slowing down inside radius
+    radius = 100
+    # mobs without a target walk along the flow field at full speed
+    free = np.isnan(target[:, 0])
+    if free.any():
+        target[free] = (pos[free] +
+                        game.flow_field.lookup(pos[free]) * radius * 2)
+    desired = target - pos
+    d = np.hypot(desired[:, 0], desired[:, 1])
+    moving = d > 0
+    desired[moving] /= d[moving, None]
+    m = np.where(d < radius, np.clip(d / radius * speed, 0, speed), speed)
+    arrive = desired * m[:, None] - vel
+    limit_rows(arrive, 1)
+
+    # separation: steer away from the mobs inside the perception radius
+    perception_radius = 40
+    i, j = neighbour_pairs(pos, pos, perception_radius)
+    diff = pos[i] - pos[j]
+    dist = np.hypot(diff[:, 0], diff[:, 1])
+    close = (i != j) & (dist < perception_radius) & (dist > 0)
+    i = i[close]
+    diff = diff[close] / (dist[close] ** 2)[:, None]
+    steering = np.zeros_like(pos)
+    steering[:, 0] = np.bincount(i, diff[:, 0], minlength=len(mobs))
+    steering[:, 1] = np.bincount(i, diff[:, 1], minlength=len(mobs))
+    length = np.hypot(steering[:, 0], steering[:, 1])
+    pushed = length > 0
+    steering[pushed] *= (speed[pushed] / length[pushed])[:, None]
+    steering[pushed] -= vel[pushed]
+    limit_rows(steering, 0.2)
+
+    vel += (arrive + steering) * speed[:, None] * dt
+    vel *= friction[:, None]
+    pos += vel
+    for mob, (x, y, vx, vy) in zip(mobs, data[:, 0:4].tolist()):
+        mob.prev_pos.update(mob.pos)
+        mob.pos.update(x, y)
+        mob.vel.update(vx, vy)
 
 
 
@@ -212,9 +496,9 @@ class Shooter(pg.sprite.Sprite):
         super().__init__(game.all_sprites, game.shooters)
         self.game = game
         self.type = type_
-        self.image_original = self.game.images[st.shooters[self.type]['image']].copy()
-        self.image = self.image_original.copy()
-        self.base_image = self.game.images[st.shooters[self.type]['base_image']].copy()
+        self.image_name = st.shooters[self.type]['image']
+        self.image = self.game.images[self.image_name]
+        self.base_image = self.game.images[st.shooters[self.type]['base_image']]
         self.rect = self.image.get_rect()
         self.base_rect = self.base_image.get_rect()
         self.pos = vec(position)
@@ -227,29 +511,45 @@ class Shooter(pg.sprite.Sprite):
         self.price = st.shooters[self.type]['price']
         self.refund = st.shooters[self.type]['refund']
         self.projectile = st.shooters[self.type]['projectile']
+        # flow field cells this tower blocks in maze mode
+        self.blocked_cells = []
     
     
     def update(self, dt):        
         self.timer += dt
-        # look for closest target
-        self.target = None
-        closest = math.inf
-        for s in self.game.mobs:
-            d = s.pos - self.pos
-            dist = d.length()
-            if dist < self.perception_radius:
-                if dist < closest:
-                    closest = dist
-                    self.target = s
-               
+        # keep the current target until it dies or leaves the range
+        if self.target and not self.in_range(self.target):
+            self.target = None
+        if not self.target:
+            self.target = self.find_target()
+
         # shoot at target
         if self.target:
             self.shoot()
 
         self.rect.center = self.pos
         self.base_rect.center = self.rect.center
-    
-    
+
+
+    def in_range(self, mob):
+        if not mob.alive():
+            return False
+        d = mob.pos - self.pos
+        return d.length_squared() < self.perception_radius ** 2
+
+
+    def find_target(self):
+        # look for the closest mob in the grid cells around the tower
+        target = None
+        closest = self.perception_radius ** 2
+        for mob in self.game.mob_grid.query(self.pos, self.perception_radius):
+            dist = (mob.pos - self.pos).length_squared()
+            if dist < closest and mob.alive():
+                closest = dist
+                target = mob
+        return target
+
+
     def shoot(self):
         target_desired = self.target.pos + self.target.vel * 30
         self.aim = target_desired - self.pos
@@ -261,216 +561,333 @@ class Shooter(pg.sprite.Sprite):
             if self.type == 'machine_gun':
                 pos1 = self.muzzle_pos + vec(-1, -8).rotate(angle)
                 pos2 = self.muzzle_pos + vec(-1, 8).rotate(angle)
-                module_dict[self.projectile](self.game, pos1, angle, dmg)
-                Muzzle_flash(self.game, pos1, angle)
-                module_dict[self.projectile](self.game, pos2, angle, dmg)
-                Muzzle_flash(self.game, pos2, angle)                
+                self.game.projectiles.spawn(self.projectile, pos1, angle, dmg)
+                self.game.flash_pool.acquire(pos1, angle)
+                self.game.projectiles.spawn(self.projectile, pos2, angle, dmg)
+                self.game.flash_pool.acquire(pos2, angle)                
             elif self.type == 'anti_air':
-                module_dict[self.projectile](self.game, self.muzzle_pos, self.target, dmg)
-                Muzzle_flash(self.game, self.muzzle_pos, angle)
+                self.game.projectiles.spawn(self.projectile, self.muzzle_pos, self.target, dmg)
+                self.game.flash_pool.acquire(self.muzzle_pos, angle)
             else:                
-                module_dict[self.projectile](self.game, self.muzzle_pos, angle, dmg)
-                Muzzle_flash(self.game, self.muzzle_pos, angle)
+                self.game.projectiles.spawn(self.projectile, self.muzzle_pos, angle, dmg)
+                self.game.flash_pool.acquire(self.muzzle_pos, angle)
             self.timer = 0
         
         # image rotation
-        img_temp = self.image_original.copy()
-        img_temp = pg.transform.rotate(img_temp, angle * -1 - 90)
-        self.image = img_temp
+        self.image = rotated_image(self.game.images, self.image_name,
+                                   angle * -1 - 90)
         self.rect = self.image.get_rect()
     
     
-    def draw(self, screen):
-        # draw base image
-        screen.blit(self.base_image, 
-                    self.game.camera.apply_pos(self.base_rect.topleft))
-        # draw muzzle
-        screen.blit(self.image, self.game.camera.apply_pos(self.rect.topleft))
+    def draw(self, queue):
+        queue.add('tower bases', self.base_image,
+                  self.game.camera.apply_pos(self.base_rect.topleft))
+        queue.add('turrets', self.image,
+                  self.game.camera.apply_pos(self.rect.topleft))
 
 
-# ----------------- physics objects -------------------------------------------   
+# ----------------- projectiles -----------------------------------------------
 
-class Physics_object(pg.sprite.Sprite):
-    def __init__(self, game, groups, position):
-        super().__init__(groups)
+class Projectile_manager(object):
+    '''
+    keeps all bullets and rockets in flat numpy arrays, so that they are
+    moved, checked for hits and removed in one go every frame instead of
+    being sprites with their own update
+    '''
+    # per projectile type: thrust, friction, hitbox size, image, lifetime
+    kinds = {
+            'Bullet': (300, 0.99, 14, 'bullet1', 3),
+            'Rocket': (1, 0.995, 30, 'rocket1', 10)
+            }
+    # rocket steering: full speed towards the target, slowing down inside
+    # rocket_radius, the steering force is limited to rocket_maxforce
+    rocket_maxspeed = 1800
+    rocket_maxforce = 10
+    rocket_radius = 40
+
+    def __init__(self, game, capacity=256):
         self.game = game
-        self.pos = vec(position)
-        self.acc = vec()
-        self.vel = vec()
-        self.steer = vec()
-        self.desired = vec()
-        self.target = vec()
-        self.friction = 1
-        self.maxspeed = 100
-        self.maxforce = 0.1
-        self.theta = 0
-        
-    
-    def update(self, dt):       
-        self.vel += self.acc * dt
-        self.pos += self.vel
-        # reset acceleration
-        self.acc *= 0
-        # apply friction
-        self.vel *= self.friction     
-        self.rect.topleft = self.pos    
-    
-    
-    def wander(self):
-        self.arrive(self.target)
-        
-        if self.vel.length_squared() != 0:
-            # extent vector as a multiple of the velocity
-            self.extent = self.vel.normalize() * 40
-            # radius
-            r = 30
-            # change the angle by a small random amount each frame
-            self.theta += randrange(-2, 3) / 16
-            self.target = self.pos + self.extent + vec(r * math.cos(self.theta), 
-                                                       r * math.sin(self.theta))
-    
-    
-    def arrive(self, target):
-        # get vector from self to target
-        self.desired = target - self.pos
-        d = self.desired.length()
-        self.desired = self.desired.normalize()        
-        radius = 40       
-        if d < radius:
-            m = remap(d, 0, radius, 0, self.maxspeed)
-            self.desired *= m            
+        self.count = 0
+        self.targets = []
+        # how often the arrays were full and had to grow
+        self.misses = 0
+        self.allocate(capacity)
+
+
+    def allocate(self, capacity):
+        # (re)creates the arrays and keeps the projectiles that are alive
+        n = self.count
+        old = getattr(self, 'arrays', None)
+        self.capacity = capacity
+        self.pos = np.zeros((capacity, 2))
+        self.prev_pos = np.zeros((capacity, 2))
+        self.vel = np.zeros((capacity, 2))
+        self.acc = np.zeros((capacity, 2))
+        self.thrust = np.zeros(capacity)
+        self.friction = np.zeros(capacity)
+        self.size = np.zeros(capacity)
+        self.damage = np.zeros(capacity)
+        self.lifetime = np.zeros(capacity)
+        self.rocket = np.zeros(capacity, dtype=bool)
+        self.arrays = [self.pos, self.prev_pos, self.vel, self.acc, self.thrust,
+                       self.friction, self.size, self.damage, self.lifetime,
+                       self.rocket]
+        if old:
+            for new_array, old_array in zip(self.arrays, old):
+                new_array[:n] = old_array[:n]
+
+
+    def spawn(self, kind, position, aim, damage):
+        # aim is the angle for bullets and the target mob for rockets
+        if self.count == self.capacity:
+            self.misses += 1
+            self.allocate(self.capacity * 2)
+        thrust, friction, size, _, lifetime = self.kinds[kind]
+        i = self.count
+        self.pos[i] = position
+        self.prev_pos[i] = position
+        self.vel[i] = 0
+        self.acc[i] = 0
+        self.rocket[i] = kind == 'Rocket'
+        if self.rocket[i]:
+            self.targets.append(aim)
         else:
-            self.desired *= self.maxspeed       
-        # calculate steering force
-        self.steer = self.desired - self.vel
-        limit(self.steer, self.maxforce)        
-        self.acc += self.steer
-        
-    
-    def seek(self, target):
-        # get vector from self to target
-        self.desired = target - self.pos
-        self.desired = self.desired.normalize()        
-        self.desired *= self.maxspeed       
-        # calculate steering force
-        self.steer = self.desired - self.vel
-        limit(self.steer, self.maxforce)        
-        self.acc += self.steer
+            self.acc[i] = (math.cos(math.radians(aim)),
+                           math.sin(math.radians(aim)))
+            self.targets.append(None)
+        self.thrust[i] = thrust
+        self.friction[i] = friction
+        self.size[i] = size
+        self.damage[i] = damage
+        self.lifetime[i] = lifetime
+        self.count += 1
+
+
+    def update(self, dt):
+        n = self.count
+        if n == 0:
+            return
+        pos = self.pos[:n]
+        vel = self.vel[:n]
+        acc = self.acc[:n]
+        self.prev_pos[:n] = pos
+        rockets = np.flatnonzero(self.rocket[:n])
+        bullets = np.flatnonzero(~self.rocket[:n])
+        alive = np.ones(n, dtype=bool)
+
+        if len(rockets):
+            # rockets home in on the current position of their target
+            targets = [self.targets[i] for i in rockets.tolist()]
+            target_pos = np.array([(t.pos.x, t.pos.y) for t in targets])
+            desired = target_pos - pos[rockets]
+            d = np.hypot(desired[:, 0], desired[:, 1])
+            moving = d > 0
+            desired[moving] /= d[moving, None]
+            m = np.where(d < self.rocket_radius,
+                         d / self.rocket_radius * self.rocket_maxspeed,
+                         self.rocket_maxspeed)
+            steer = desired * m[:, None] - vel[rockets]
+            limit_rows(steer, self.rocket_maxforce)
+            acc[rockets] += steer
+
+        # bullets apply friction before they move, rockets after
+        vel += acc * (self.thrust[:n] * dt)[:, None]
+        acc[:] = 0
+        friction = self.friction[:n]
+        rocket = self.rocket[:n]
+        vel[~rocket] *= friction[~rocket, None]
+        pos += vel
+        vel[rocket] *= friction[rocket, None]
+
+        self.lifetime[:n] -= dt
+        alive &= self.lifetime[:n] > 0
+        # destroy projectiles that left the map
+        half = self.size[:n] / 2
+        map_w, map_h = self.game.map_rect.size
+        alive &= ((pos[:, 0] + half > 0) & (pos[:, 0] - half < map_w) &
+                  (pos[:, 1] + half > 0) & (pos[:, 1] - half < map_h))
+        speed = np.hypot(vel[bullets, 0], vel[bullets, 1])
+        alive[bullets[speed <= 1]] = False
+
+        if len(rockets):
+            self.hit_targets(rockets, targets, alive)
+        if len(bullets):
+            self.hit_mobs(bullets, alive)
+        self.compact(alive)
+
+
+    def hit_targets(self, rockets, targets, alive):
+        # rockets only collide with the mob they are following
+        boxes = np.array([(t.hitbox.centerx, t.hitbox.centery,
+                           t.hitbox.w, t.hitbox.h) for t in targets], dtype=float)
+        reach = (self.size[rockets, None] + boxes[:, 2:4]) / 2
+        hits = (np.abs(self.pos[rockets] - boxes[:, 0:2]) < reach).all(axis=1)
+        for k in np.flatnonzero(hits).tolist():
+            targets[k].hp -= self.damage[rockets[k]]
+        for k, target in enumerate(targets):
+            if hits[k] or target.hp <= 0 or not target.alive():
+                alive[rockets[k]] = False
+
+
+    def hit_mobs(self, bullets, alive):
+        # broadphase of all bullets against all mobs, every bullet damages
+        # at most one mob, the first one in game.mobs like before
+        mobs = self.game.mobs.sprites()
+        if not mobs:
+            return
+        boxes = np.array([(m.hitbox.centerx, m.hitbox.centery,
+                           m.hitbox.w, m.hitbox.h) for m in mobs], dtype=float)
+        bullet_pos = self.pos[bullets]
+        sizes = self.size[bullets]
+        cell_size = (boxes[:, 2:4].max() + sizes.max()) / 2
+        i, j = neighbour_pairs(bullet_pos, boxes[:, 0:2], cell_size)
+        reach = (sizes[i, None] + boxes[j, 2:4]) / 2
+        overlap = (np.abs(bullet_pos[i] - boxes[j, 0:2]) < reach).all(axis=1)
+        i = i[overlap]
+        j = j[overlap]
+        if not len(i):
+            return
+        order = np.lexsort((j, i))
+        i = i[order]
+        j = j[order]
+        first = np.unique(i, return_index=True)[1]
+        i = i[first]
+        j = j[first]
+        damage = np.bincount(j, self.damage[bullets[i]], minlength=len(mobs))
+        for k in np.flatnonzero(damage).tolist():
+            mobs[k].hp -= float(damage[k])
+        alive[bullets[i]] = False
+
+
+    def compact(self, alive):
+        # move the remaining projectiles to the front of the arrays
+        keep = np.flatnonzero(alive)
+        k = len(keep)
+        if k == self.count:
+            return
+        for array in self.arrays:
+            array[:k] = array[keep]
+        self.targets = [self.targets[i] for i in keep.tolist()]
+        self.count = k
+
+
+    def draw(self, queue, viewport):
+        # adds the projectiles inside the viewport rect to the render queue,
+        # returns how many were skipped
+        n = self.count
+        if n == 0:
+            return 0
+        images = self.game.images
+        rocket_image = self.kinds['Rocket'][3]
+        bullet_image = images[self.kinds['Bullet'][3]]
+        offset = self.game.camera.offset
+        scale = self.game.camera.scale
+        blits = []
+        # interpolate between the last two steps
+        prev_pos = self.prev_pos[:n]
+        pos = prev_pos + (self.pos[:n] - prev_pos) * self.game.alpha
+        visible = ((pos[:, 0] > viewport.left) & (pos[:, 0] < viewport.right) &
+                   (pos[:, 1] > viewport.top) & (pos[:, 1] < viewport.bottom))
+        pos = pos[visible]
+        rocket = self.rocket[:n][visible]
+        vel = self.vel[:n][visible]
+        # same angle as vel.angle_to(vec(0, -1))
+        angles = -90 - np.degrees(np.arctan2(vel[:, 1], vel[:, 0]))
+        for (x, y), is_rocket, angle in zip(pos.tolist(), rocket.tolist(),
+                                           angles.tolist()):
+            if is_rocket:
+                image = rotated_image(images, rocket_image, angle)
+            else:
+                image = bullet_image
+            w, h = image.get_size()
+            blits.append((image, ((x - w / 2 + offset.x) * scale,
+                                  (y - h / 2 + offset.y) * scale)))
+        queue.extend('projectiles', blits)
+        return n - len(pos)
+
+
+    def draw_debug(self, screen):
+        camera = self.game.camera
+        for i in range(self.count):
+            size = self.size[i]
+            hitbox = pg.Rect(0, 0, size, size)
+            hitbox.center = self.pos[i]
+            pg.draw.rect(screen, st.RED, camera.apply_rect(hitbox), 1)
+            target = self.targets[i]
+            if target:
+                start = camera.apply_pos(vec(self.pos[i].tolist()))
+                end = camera.apply_pos(target.pos)
+                pg.draw.line(screen, st.WHITE, start, end)
+
 
 
 
-class Bullet(pg.sprite.Sprite):
-    def __init__(self, game, position, angle, damage):
-        super().__init__(game.all_sprites, game.bullets)
+# ---------- Particles and Effects --------------------------------------------
+
+class Pool(object):
+    '''
+    keeps killed sprites around to hand them out again instead of creating
+    new ones, the sprite class needs a reset() method that takes the same
+    arguments as its constructor (without game) and adds it to its groups
+    '''
+    def __init__(self, game, sprite_class):
         self.game = game
-        self.image_original = self.game.images['bullet1'].copy()
-        self.image = self.image_original.copy()
-        self.rect = self.image.get_rect()
-        self.hitbox = pg.Rect(0, 0, 14, 14)
-        self.pos = vec(position)
-        self.rect.center = self.pos
-        self.hitbox.center = self.rect.center
-        self.acc = vec()
-        self.acc.from_polar((1, angle))
-        self.vel = vec()
-        self.friction = 0.99
-        self.speed = 300
-        
-        self.damage = damage
-    
-    
-    def update(self, dt):
-        self.vel += self.acc * self.speed * dt
-        self.acc *= 0
-        self.vel *= self.friction
-        self.pos += self.vel
-            
-        self.rect.center = self.pos
-        self.hitbox.center = self.rect.center
-        
-        if not self.game.map_rect.colliderect(self.hitbox):
-            self.kill()
-            
-        if self.vel.length() <= 1:
-            self.kill()
+        self.sprite_class = sprite_class
+        self.free = []
+        # the pool only grows when all sprites are in use, so this is also
+        # the most that were ever in use at once
+        self.created = 0
 
-        for mob in self.game.mobs:
-            if self.hitbox.colliderect(mob.hitbox):
-                mob.hp -= self.damage
-                self.kill()
-    
-    
-    def draw(self, screen):
-        screen.blit(self.image, self.game.camera.apply_pos(self.rect.topleft))
-        
 
+    def acquire(self, *args):
+        if self.free:
+            sprite = self.free.pop()
+            sprite.reset(*args)
+        else:
+            # pool is empty, this is the only place that allocates
+            self.created += 1
+            sprite = self.sprite_class(self.game, *args)
+        return sprite
 
-class Rocket(Physics_object):
-    def __init__(self, game, position, target, damage):
-        groups = [game.all_sprites, game.bullets]
-        super().__init__(game, groups, position)
-        self.image_original = self.game.images['rocket1'].copy()
-        self.image = self.image_original.copy()
-        self.rect = self.image.get_rect()
-        self.hitbox = pg.Rect(0, 0, 30, 30)
-        
-        self.maxspeed = 1800
-        self.friction = 0.995
-        self.maxforce = 10
-        
-        self.target = target
-        self.damage = damage
-    
-        
-    def update(self, dt):
-        self.arrive(self.target.pos)
-        super().update(dt)
-        
-        # rotate image in the direction of velocity
-        angle = self.vel.angle_to(vec(0, -1))
-        self.image = pg.transform.rotate(self.image_original, angle)
-        self.rect = self.image.get_rect()
-        
-        self.rect.center = self.pos
-        self.hitbox.center = self.rect.center
-        
-        if self.hitbox.colliderect(self.target.hitbox):
-            self.target.hp -= self.damage
-            self.kill()
-        # destroy rocket if out of bounds
-        if not self.game.map_rect.colliderect(self.rect) or self.target.hp <= 0:
-            self.kill()
-    
-    
-    def draw(self, screen):
-        screen.blit(self.image, self.game.camera.apply_pos(self.rect.topleft))
 
+    def release(self, sprite):
+        sprite.kill()
+        self.free.append(sprite)
 
 
+    def in_use(self):
+        return self.created - len(self.free)
+
 
-# ---------- Particles and Effects --------------------------------------------
 
 class Muzzle_flash(pg.sprite.Sprite):
     def __init__(self, game, position, angle):
-        super().__init__(game.all_sprites)
+        super().__init__()
         self.game = game
-        self.image = self.game.images['flash1'].copy()
-        self.image = pg.transform.rotate(self.image, angle * -1 - 90)      
-        self.rect = self.image.get_rect()
+        self.rect = pg.Rect(0, 0, 0, 0)
+        self.alpha_reduction = 3000
+        self.reset(position, angle)
+
+
+    def reset(self, position, angle):
+        # shared images, see faded_image
+        self.angle = angle * -1 - 90
+        self.image = rotated_image(self.game.images, 'flash1', self.angle)
+        self.rect.size = self.image.get_size()
         self.rect.center = position
         self.alpha = 255
-        self.alpha_reduction = 3000
+        self.add(self.game.all_sprites, self.game.effects)
     
     
     def update(self, dt):
         self.alpha = max(0, self.alpha - self.alpha_reduction * dt)
-        self.image.set_alpha(self.alpha)
         if self.alpha == 0:
-            self.kill()
+            self.game.flash_pool.release(self)
     
     
-    def draw(self, screen):
-        screen.blit(self.image, self.game.camera.apply_pos(self.rect.topleft))
+    def draw(self, queue):
+        image = faded_image(self.game.images, 'flash1', self.angle, self.alpha)
+        queue.add('effects', image, self.game.camera.apply_pos(self.rect.topleft))
         
     
     